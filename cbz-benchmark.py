@@ -0,0 +1,714 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.13"
+# dependencies = [
+#     "beautifulsoup4",
+#     "click",
+#     "h2",
+#     "httpx[http2]",
+#     "lxml",
+#     "pillow",
+#     "requests",
+#     "rich",
+# ]
+# ///
+
+import asyncio
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import click
+import h2.config
+import h2.connection
+import h2.events
+
+CONTEXT_SETTINGS = dict(help_option_names=["--help", "-h"])
+
+
+def load_cbz_from_webpage():
+    """
+    Imports cbz-from-webpage.py from next to this script, which can't be imported by name because of the dashes.
+
+    Returns:
+        module: The cbz-from-webpage.py module.
+    """
+
+    path = Path(__file__).with_name("cbz-from-webpage.py")
+    spec = importlib.util.spec_from_file_location("cbz_from_webpage", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    logging.getLogger().setLevel(logging.WARNING)
+    return module
+
+
+def synthetic_gallery(images, filler=20):
+    """
+    Builds a gallery page in the style of a blog post: 'images' page images, each wrapped in a few paragraphs of
+    unrelated markup, plus some theme images that the script has to filter out.
+
+    Args:
+        images (int): The number of page images.
+        filler (int): The number of filler paragraphs around each image.
+
+    Returns:
+        bytes: The HTML document.
+    """
+
+    paragraph = (
+        '<p class="entry">Lorem <a href="/tag/x">ipsum</a> dolor &amp; sit amet.</p>'
+    )
+    parts = [
+        '<html><head><meta charset="utf-8"><title>Gallery</title></head><body>',
+        '<img src="https://example.com/theme/logo.png" alt="logo">',
+    ]
+    for number in range(1, images + 1):
+        parts.append(paragraph * filler)
+        parts.append(
+            f'<figure><img src="https://example.com/wp-content/uploads/2024/01/'
+            f'chapter-01-page-{number:03d}.jpg" alt="page {number}"></figure>'
+        )
+    parts.append('<img src="https://example.com/theme/footer.png"></body></html>')
+    return "".join(parts).encode("utf-8")
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Serves the files of a 'FixtureServer' over HTTP/1.1 with keep-alive, after the server's simulated delays.
+
+    '/_stats' returns, and resets, the number of injected errors as JSON, for servers running in another process.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        time.sleep(self.server.connect_delay)
+        self.server.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            self.send_body(json.dumps(self.server.take_stats()).encode())
+            return
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        time.sleep(self.server.latency)
+        if self.server.inject_error():
+            self.send_error(500)
+            return
+        self.send_body(body)
+
+    def send_body(self, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    An HTTP/1.1 server for in-memory fixture files that adds 'latency' seconds before each response and
+    'connect_delay' seconds to each new connection, standing in for the round trips of a TCP and TLS handshake.
+    A share 'error_rate' of the responses, picked at random, are 500 errors instead.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, files, latency, connect_delay, error_rate=0.0, seed=None):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.files = files
+        self.latency = latency
+        self.connect_delay = connect_delay
+        self.error_rate = error_rate
+        self.connections = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def inject_error(self):
+        """Returns True, and counts the error, if this response should fail."""
+
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            self.errors += failed
+        return failed
+
+    def take_stats(self):
+        """Returns and resets the number of injected errors."""
+
+        with self._lock:
+            stats = {"errors": self.errors}
+            self.errors = 0
+        return stats
+
+
+class H2FixtureServer:
+    """
+    The HTTP/2 counterpart of 'FixtureServer', speaking cleartext HTTP/2 with prior knowledge (h2c) on an event
+    loop in a background thread. Every request is answered on its own stream as soon as its latency has passed,
+    so concurrent requests share one connection.
+    """
+
+    def __init__(self, files, latency, connect_delay):
+        self.files = files
+        self.latency = latency
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._serve, "127.0.0.1", 0)
+        )
+        self.server_address = self._server.sockets[0].getsockname()
+
+    def serve_forever(self):
+        self._loop.run_forever()
+
+    def shutdown(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _serve(self, reader, writer):
+        await asyncio.sleep(self.connect_delay)
+        self.connections += 1
+        conn = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False, header_encoding="utf-8")
+        )
+        conn.initiate_connection()
+        window_open = asyncio.Event()
+        responses = set()
+        try:
+            while data := await reader.read(65536):
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        path = dict(event.headers)[":path"]
+                        response = asyncio.create_task(
+                            self._respond(
+                                conn, writer, window_open, event.stream_id, path
+                            )
+                        )
+                        responses.add(response)
+                        response.add_done_callback(responses.discard)
+                    elif isinstance(event, h2.events.WindowUpdated):
+                        window_open.set()
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+                writer.write(conn.data_to_send())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for response in responses:
+                response.cancel()
+            writer.close()
+
+    async def _respond(self, conn, writer, window_open, stream_id, path):
+        body = self.files.get(path)
+        await asyncio.sleep(self.latency)
+        if body is None:
+            conn.send_headers(stream_id, [(":status", "404")], end_stream=True)
+            writer.write(conn.data_to_send())
+            return
+        conn.send_headers(
+            stream_id, [(":status", "200"), ("content-length", str(len(body)))]
+        )
+        view = memoryview(body)
+        while view:
+            window = min(
+                conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size
+            )
+            if window <= 0:
+                window_open.clear()
+                await window_open.wait()
+                continue
+            conn.send_data(stream_id, view[:window].tobytes())
+            view = view[window:]
+            writer.write(conn.data_to_send())
+            await writer.drain()
+        conn.end_stream(stream_id)
+        writer.write(conn.data_to_send())
+
+
+@contextmanager
+def fixture_servers(images, image_size, latency, connect_delay):
+    """
+    Serves a synthetic gallery over HTTP/1.1 and its images over both HTTP/1.1 and HTTP/2, each on a local port.
+
+    The gallery page is always fetched over HTTP/1.1, as the script's requests session does; '/gallery-h1.html'
+    links the images on the HTTP/1.1 server and '/gallery-h2.html' the same images on the HTTP/2 server.
+
+    Args:
+        images (int): The number of images in the gallery.
+        image_size (int): The size of each image in bytes.
+        latency (float): Seconds added before each response.
+        connect_delay (float): Seconds added to each new connection.
+
+    Yields:
+        tuple: The gallery server and the HTTP/1.1 and HTTP/2 image servers, whose 'connections' count the
+        connections they accepted.
+    """
+
+    paths = [
+        f"/wp-content/uploads/2024/01/chapter-01-page-{number:03d}.jpg"
+        for number in range(1, images + 1)
+    ]
+    files = {path: os.urandom(image_size) for path in paths}
+    h1 = FixtureServer(files, latency, 0)
+    h2_server = H2FixtureServer(files, latency, connect_delay)
+    h1_images = FixtureServer(files, latency, connect_delay)
+    for name, server in (("h1", h1_images), ("h2", h2_server)):
+        host, port = server.server_address
+        gallery = "".join(
+            f'<p>Page</p><img src="http://{host}:{port}{path}">' for path in paths
+        )
+        files[f"/gallery-{name}.html"] = f"<html><body>{gallery}</body></html>".encode()
+    threads = [
+        threading.Thread(target=server.serve_forever, daemon=True)
+        for server in (h1, h1_images, h2_server)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        yield h1, h1_images, h2_server
+    finally:
+        for server in (h1, h1_images, h2_server):
+            server.shutdown()
+
+
+def serve_gallery(ready, images, image_size, size_spread, latency, error_rate, seed):
+    """
+    Serves a synthetic gallery from a 'FixtureServer' until the process is terminated. Meant to be the target of
+    a separate process, so that the fixture files don't count towards the peak RSS of the benchmark.
+
+    The image sizes follow a log-normal distribution around 'image_size', as scans of a chapter vary with their
+    content, and are drawn from 'seed' so every run serves the same gallery.
+
+    Args:
+        ready (multiprocessing.Queue): Receives the URL of the gallery page once the server is listening.
+        images (int): The number of images in the gallery.
+        image_size (int): The median size of the images in bytes.
+        size_spread (float): The sigma of the log-normal size distribution; 0 makes every image the same size.
+        latency (float): Seconds added before each response.
+        error_rate (float): The share of responses that are 500 errors.
+        seed (int): The seed for the image sizes, contents and injected errors.
+    """
+
+    sizes = random.Random(seed)
+    contents = random.Random(seed + 1)
+    files = {}
+    for number in range(1, images + 1):
+        size = max(1, round(image_size * sizes.lognormvariate(0, size_spread)))
+        path = f"/wp-content/uploads/2024/01/chapter-01-page-{number:03d}.jpg"
+        files[path] = contents.randbytes(size)
+    server = FixtureServer(files, latency, 0, error_rate, seed)
+    host, port = server.server_address
+    gallery = "".join(
+        f'<p>Page</p><img src="http://{host}:{port}{path}">' for path in list(files)
+    )
+    files["/gallery.html"] = f"<html><body>{gallery}</body></html>".encode()
+    ready.put(f"http://{host}:{port}/gallery.html")
+    server.serve_forever()
+
+
+@contextmanager
+def gallery_process(*args):
+    """Runs 'serve_gallery' with 'args' in a child process and yields the URL of its gallery page."""
+
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve_gallery, args=(ready, *args), daemon=True
+    )
+    process.start()
+    try:
+        yield ready.get(timeout=60)
+    finally:
+        process.terminate()
+        process.join()
+
+
+def percentile(data, percent):
+    """Returns the 'percent' percentile of 'data', or None if it has fewer than two values."""
+
+    if len(data) < 2:
+        return None
+    return statistics.quantiles(data, n=100, method="inclusive")[percent - 1]
+
+
+def peak_rss_mb():
+    """Returns the peak RSS of this process in MiB; macOS reports ru_maxrss in bytes, Linux in KiB."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def current_commit():
+    """Returns the short hash of the commit checked out next to this script, or None outside a git checkout."""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+def main():
+    """Benchmarks for cbz-from-webpage.py."""
+
+
+@main.command()
+@click.argument("fixtures", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-n", "--repeat", default=5, show_default=True, help="Parses per backend and page"
+)
+@click.option(
+    "--images",
+    default=500,
+    show_default=True,
+    help="Images in the synthetic page used when no FIXTURES are given",
+)
+def parse(fixtures, repeat, images):
+    """
+    Compares the 'extract_image_sources' backends on saved gallery pages.
+
+    Each FIXTURE is a gallery page saved as HTML. Every backend must find exactly the same image sources as
+    'html.parser'; the median parse time of each is printed along with its speedup.
+    """
+
+    cbz = load_cbz_from_webpage()
+    if fixtures:
+        pages = {fixture: Path(fixture).read_bytes() for fixture in fixtures}
+    else:
+        pages = {f"synthetic ({images} images)": synthetic_gallery(images)}
+
+    failed = False
+    for name, html in pages.items():
+        click.echo(f"{name}: {len(html) / 1_000_000:.2f} MB")
+        expected = cbz.extract_image_sources(html, "html.parser")
+        baseline = None
+        for parser in cbz.PARSERS:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                sources = cbz.extract_image_sources(html, parser)
+                timings.append(time.perf_counter() - started)
+            median = statistics.median(timings)
+            baseline = baseline or median
+            status = "ok" if sources == expected else "MISMATCH"
+            failed = failed or sources != expected
+            click.echo(
+                f"  {parser:12} {median * 1000:9.2f} ms  {baseline / median:6.1f}x  "
+                f"{len(sources)} sources  {status}"
+            )
+    if failed:
+        raise SystemExit(1)
+
+
+@main.command()
+@click.option("--images", default=200, show_default=True, help="Images in the gallery")
+@click.option(
+    "--image-size",
+    default=50_000,
+    show_default=True,
+    help="Size of each image in bytes",
+)
+@click.option(
+    "--latency",
+    default=0.05,
+    show_default=True,
+    help="Seconds the server waits before each response",
+)
+@click.option(
+    "--connect-delay",
+    default=0.06,
+    show_default=True,
+    help="Seconds added to each new image connection, standing in for the TCP and TLS handshakes",
+)
+@click.option("-n", "--repeat", default=3, show_default=True, help="Runs per transport")
+def transport(images, image_size, latency, connect_delay, repeat):
+    """
+    Compares the HTTP/1.1 and HTTP/2 image transports against local fixture servers.
+
+    A synthetic gallery is built into an archive with 'build_cbz' by each engine: 'threads' and 'async' over
+    HTTP/1.1 and 'http2' multiplexed over HTTP/2. The median wall time, the speedup over 'threads' and the number
+    of image connections opened are printed.
+    """
+
+    cbz = load_cbz_from_webpage()
+    with fixture_servers(images, image_size, latency, connect_delay) as servers:
+        h1, h1_images, h2_server = servers
+        host, port = h1.server_address
+        runs = [
+            ("threads", "h1", h1_images, cbz.Downloader),
+            ("async", "h1", h1_images, cbz.AsyncDownloader),
+            (
+                "http2",
+                "h2",
+                h2_server,
+                lambda: cbz.Http2Downloader(prior_knowledge=True),
+            ),
+        ]
+        baseline = None
+        with tempfile.TemporaryDirectory() as directory:
+            for engine, protocol, server, make_downloader in runs:
+                url = f"http://{host}:{port}/gallery-{protocol}.html"
+                timings = []
+                server.connections = 0
+                for run in range(repeat):
+                    output = os.path.join(directory, f"{engine}-{run}.cbz")
+                    started = time.perf_counter()
+                    with make_downloader() as downloader:
+                        cbz.build_cbz(url, output, downloader)
+                    timings.append(time.perf_counter() - started)
+                median = statistics.median(timings)
+                baseline = baseline or median
+                click.echo(
+                    f"{engine:8} {median:7.2f} s  {images / median:7.1f} images/s  "
+                    f"{baseline / median:5.1f}x  "
+                    f"{server.connections / repeat:5.1f} connections"
+                )
+
+
+@main.command()
+@click.option("--images", default=200, show_default=True, help="Images in the gallery")
+@click.option(
+    "--image-size",
+    default=300_000,
+    show_default=True,
+    help="Median size of the images in bytes",
+)
+@click.option(
+    "--size-spread",
+    default=0.5,
+    show_default=True,
+    help="Sigma of the log-normal image size distribution, 0 for equal sizes",
+)
+@click.option(
+    "--latency",
+    default=0.02,
+    show_default=True,
+    help="Seconds the server waits before each response",
+)
+@click.option(
+    "--error-rate",
+    default=0.0,
+    show_default=True,
+    help="Share of responses that fail with a 500 error and have to be retried",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(["threads", "async", "http2"]),
+    default="threads",
+    show_default=True,
+    help="The downloader to benchmark",
+)
+@click.option(
+    "--pipeline",
+    is_flag=True,
+    help="Benchmark 'stream_cbz' instead of 'download_images' followed by 'create_cbz'",
+)
+@click.option(
+    "-n", "--repeat", default=3, show_default=True, help="Runs to take the median of"
+)
+@click.option("--seed", default=0, show_default=True, help="Seed for the gallery")
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the results to this JSON file instead of standard output",
+)
+def pipeline(
+    images,
+    image_size,
+    size_spread,
+    latency,
+    error_rate,
+    engine,
+    pipeline,
+    repeat,
+    seed,
+    output,
+):
+    """
+    Runs the real download and packaging pipeline end to end against a local fixture server.
+
+    A synthetic gallery is served from a separate process with the given latency and error rate, and built into
+    a CBZ file 'repeat' times. The results are printed as JSON: the median pages per second and MB/s, the median
+    time of each stage, the p50 and p99 latency of an image request as seen by the client (time to first byte
+    plus transfer, from the downloader's metrics), and the peak RSS of the benchmark process. Save them with
+    '--output' and compare two commits with 'compare'.
+
+    The gallery is fetched once per run, by the stage under test, as in a real run: 'download_images' includes
+    finding the images, and the downloader's image count checks that every page was found.
+    """
+
+    cbz = load_cbz_from_webpage()
+    engines = {
+        "threads": cbz.Downloader,
+        "async": cbz.AsyncDownloader,
+        "http2": cbz.Http2Downloader,
+    }
+    options = cbz.ChapterOptions(pipeline=pipeline)
+    gallery = (images, image_size, size_spread, latency, error_rate, seed)
+    runs = []
+    latencies = []
+    errors = 0
+    with gallery_process(*gallery) as url, tempfile.TemporaryDirectory() as directory:
+        stats_url = url.replace("/gallery.html", "/_stats")
+        for run in range(repeat):
+            output_name = os.path.join(directory, f"run-{run}.cbz")
+            stages = {}
+            started = time.perf_counter()
+            with engines[engine]() as downloader:
+                stage_started = time.perf_counter()
+                if pipeline:
+                    cbz.stream_cbz(url, output_name, options, downloader)
+                    stages["stream_cbz"] = time.perf_counter() - stage_started
+                else:
+                    pages = cbz.download_images(
+                        url, downloader, output_name + cbz.PAGES_SUFFIX, options
+                    )
+                    stages["download_images"] = time.perf_counter() - stage_started
+                    stage_started = time.perf_counter()
+                    cbz.create_cbz(output_name, Path(pages))
+                    stages["create_cbz"] = time.perf_counter() - stage_started
+                if downloader.images != images:
+                    raise click.ClickException(
+                        f"Downloaded {downloader.images} of {images} images"
+                    )
+                megabytes = downloader.bytes / 1_000_000
+                latencies.extend(
+                    image["ttfb"] + image["transfer"]
+                    for image in downloader.metrics.images
+                    if image["error"] is None and image["ttfb"] is not None
+                )
+            elapsed = time.perf_counter() - started
+            runs.append(
+                {
+                    "seconds": elapsed,
+                    "pages_per_second": images / elapsed,
+                    "mb_per_second": megabytes / elapsed,
+                    "stages": stages,
+                }
+            )
+            stats = json.loads(cbz.requests.get(stats_url).content)
+            errors += stats["errors"]
+
+    def median(key):
+        return statistics.median(run[key] for run in runs)
+
+    p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+    results = {
+        "commit": current_commit(),
+        "config": {
+            "images": images,
+            "image_size": image_size,
+            "size_spread": size_spread,
+            "latency": latency,
+            "error_rate": error_rate,
+            "engine": engine,
+            "pipeline": pipeline,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "seconds": median("seconds"),
+        "pages_per_second": median("pages_per_second"),
+        "mb_per_second": median("mb_per_second"),
+        "latency_p50_ms": p50 and p50 * 1000,
+        "latency_p99_ms": p99 and p99 * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "errors_injected": errors,
+        "stages": {
+            stage: statistics.median(run["stages"][stage] for run in runs)
+            for stage in runs[0]["stages"]
+        },
+    }
+    text = json.dumps(results, indent=2)
+    if output:
+        Path(output).write_text(text + "\n", encoding="utf-8")
+    else:
+        click.echo(text)
+
+
+COMPARED_METRICS = {
+    "pages_per_second": True,
+    "mb_per_second": True,
+    "latency_p50_ms": False,
+    "latency_p99_ms": False,
+    "peak_rss_mb": False,
+}
+
+
+@main.command()
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("candidate", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--threshold",
+    default=10.0,
+    show_default=True,
+    help="Percentage by which a metric may get worse before it counts as a regression",
+)
+def compare(baseline, candidate, threshold):
+    """
+    Compares two 'pipeline' results, such as from two commits.
+
+    Prints the change of each metric and stage time, and exits with status 1 if any of them got worse by more
+    than the threshold. Results from different configurations can't be compared and are rejected.
+    """
+
+    before = json.loads(Path(baseline).read_text(encoding="utf-8"))
+    after = json.loads(Path(candidate).read_text(encoding="utf-8"))
+    if before["config"] != after["config"]:
+        raise click.ClickException("The results come from different configurations")
+
+    metrics = [
+        (name, before[name], after[name], higher)
+        for name, higher in COMPARED_METRICS.items()
+    ]
+    metrics += [
+        (f"stages.{stage}", seconds, after["stages"].get(stage), False)
+        for stage, seconds in before["stages"].items()
+    ]
+    click.echo(
+        f"{'':24} {before['commit'] or 'baseline':>12} {after['commit'] or 'candidate':>12}"
+    )
+    regressions = 0
+    for name, old, new, higher_is_better in metrics:
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        worse = -change if higher_is_better else change
+        regressed = worse > threshold
+        regressions += regressed
+        click.echo(
+            f"{name:24} {old:12.2f} {new:12.2f} {change:+7.1f}%"
+            + ("  REGRESSION" if regressed else "")
+        )
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
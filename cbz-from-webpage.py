@@ -4,41 +4,148 @@
 # dependencies = [
 #     "beautifulsoup4",
 #     "click",
+#     "httpx[http2]",
+#     "lxml",
+#     "pillow",
 #     "requests",
+#     "rich",
 # ]
 # ///
 
+# A single-file uv script that is run, and copied around, on its own, so the cache, the ZIP writer and the
+# download engines live here rather than in sibling modules it would need installed next to it
+# pylint: disable=too-many-lines
+
+import asyncio
+import cProfile
+import email.utils
+import hashlib
+import io
+import json
 import logging
 import os
+import re
 import shutil
+import sqlite3
+import statistics
+import struct
 import sys
 import tempfile
+import threading
+import time
 import zipfile
-from collections import Counter
+import zlib
+from collections import Counter, defaultdict, deque, namedtuple
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from html.parser import HTMLParser
+from itertools import islice
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
-
+from concurrent.futures import (
+    CancelledError,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from urllib.parse import urljoin, urlsplit
+
+import httpx
 import requests
 import click
-from bs4 import BeautifulSoup
+import lxml.etree
+import lxml.html
+from bs4 import BeautifulSoup, SoupStrainer, UnicodeDammit
+from PIL import Image, ImageOps
+from rich.console import Console
+from rich.logging import RichHandler
+from rich.progress import (
+    BarColumn,
+    DownloadColumn,
+    Progress,
+    TextColumn,
+    TimeRemainingColumn,
+    TransferSpeedColumn,
+)
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
 logging.basicConfig(level=logging.INFO)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+MAX_WORKERS = 5
+MAX_DOWNLOADS = 16
+MAX_PER_HOST = 32
+RETRIES = 3
+BACKOFF_FACTOR = 0.3
+RETRY_STATUSES = (500, 502, 504)
+THROTTLE_STATUSES = (429, 503)
+LATENCY_TOLERANCE = 2.0
+DECREASE_INTERVAL = 1.0
+CHUNK_SIZE = 64 * 1024
+PART_SUFFIX = ".part"
+PAGES_SUFFIX = ".pages"
+MANIFEST_NAME = ".manifest.jsonl"
+CACHE_MAX_SIZE = 2 * 1024**3
+PROGRESS_INTERVAL = 5.0
+NEXT_SELECTORS = ("a[rel~=next]", "link[rel~=next]")
+HASH_PATTERN = re.compile(r"(?=[0-9a-f]*\d)[0-9a-f]{8,}", re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r"\d+")
+NATURAL_PARTS = re.compile(r"(\d+)")
+PAGE_NAME_WIDTH = 4
+
+CachedPage = namedtuple("CachedPage", ["conditional_headers", "body", "image_sources"])
+PageSet = namedtuple("PageSet", ["template", "urls", "total"])
+Transcode = namedtuple(
+    "Transcode", ["max_dimension", "format", "quality"], defaults=[None, "jpeg", 85]
+)
+ChapterOptions = namedtuple(
+    "ChapterOptions",
+    [
+        "pipeline",
+        "compression",
+        "parser",
+        "max_pages",
+        "next_selectors",
+        "transcode",
+        "page_template",
+        "allow_gaps",
+    ],
+    defaults=[False, "store", "html.parser", 1, NEXT_SELECTORS, None, None, False],
+)
+PIPELINE_WINDOW = MAX_WORKERS * 2
+TRANSCODE_WINDOW = max(PIPELINE_WINDOW, 2 * (os.cpu_count() or 1))
+TRANSCODE_FORMATS = {"jpeg": ("JPEG", ".jpg"), "webp": ("WEBP", ".webp")}
+
+ZIP_FLAG_UTF8 = 0x800
+ZIP_MADE_BY_UNIX = 3 << 8 | 20
+ZIP_MAX_SIZE = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
 
 
 def backoff_retry_session(
-    retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), session=None
+    retries=RETRIES,
+    backoff_factor=BACKOFF_FACTOR,
+    status_forcelist=RETRY_STATUSES,
+    session=None,
+    pool_size=MAX_WORKERS,
+    respect_retry_after=True,
 ):
     """
-    Creates and configures a retry-enabled session object using the requests library. The session automatically retries
-    requests for a specified number of times with an increasing backoff delay if certain HTTP status codes are encountered.
+    Creates and configures a retry-enabled session object using the requests library. The session automatically
+    retries requests for a specified number of times with an increasing backoff delay if certain HTTP status codes
+    are encountered.
 
     Args:
         retries (int): The maximum number of retries for each request. Defaults to 3.
         backoff_factor (float): The factor by which the delay between retries increases. Defaults to 0.3.
         status_forcelist (tuple): A tuple of HTTP status codes that should trigger a retry. Defaults to (500, 502, 504).
         session (requests.Session): An existing session object to be used. If not provided, a new session is created.
+        pool_size (int): The number of keep-alive connections kept open per host. Should match the number of
+            threads sharing the session so that no worker has to open a fresh connection. Defaults to MAX_WORKERS.
+        respect_retry_after (bool): Whether urllib3 retries 429 and 503 responses carrying a Retry-After header,
+            sleeping in the calling thread until then. Turn it off where the caller handles throttling itself.
+            Defaults to True.
 
     Returns:
         requests.Session: A configured session object that performs automatic retries.
@@ -61,55 +168,1849 @@ def backoff_retry_session(
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
         allowed_methods=frozenset(["GET", "POST", "HEAD"]),
+        respect_retry_after_header=respect_retry_after,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_size)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
 
 
-def download_image(img_url, save_directory):
+def connection_stats(session):
+    """
+    Counts the requests sent and connections opened by a session's connection pools.
+
+    Args:
+        session (requests.Session): A session created by 'backoff_retry_session'.
+
+    Returns:
+        tuple: A (requests, connections) pair summed across every host pool of the session. Requests beyond the
+        number of connections were served over a reused keep-alive connection.
+
+    Example:
+        session = backoff_retry_session()
+        session.get("https://example.com/a.jpg")
+        session.get("https://example.com/b.jpg")
+        print(connection_stats(session))
+        # Output: (2, 1)
+    """
+
+    requests_sent = 0
+    connections = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+    return requests_sent, connections
+
+
+def log_connection_stats(session):
+    """
+    Logs how many requests a session sent and how many of them reused a keep-alive connection.
+
+    Args:
+        session (requests.Session): A session created by 'backoff_retry_session'.
+    """
+
+    requests_sent, connections = connection_stats(session)
+    logging.info(
+        "Sent %s requests over %s connections (%s reused)",
+        requests_sent,
+        connections,
+        requests_sent - connections,
+    )
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header.
+
+    Args:
+        value (str): The header value, either a number of seconds or an HTTP date. May be None.
+
+    Returns:
+        float: The number of seconds to wait, or None if the header is missing or malformed.
+
+    Example:
+        print(parse_retry_after("120"))
+        # Output: 120.0
+    """
+
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class HostController:
+    """
+    Adapts the number of concurrent downloads from one host with additive-increase/multiplicative-decrease (AIMD).
+
+    Every response that is healthy, meaning its time to first byte stays within LATENCY_TOLERANCE times the
+    fastest seen from the host, raises the limit by 1/limit, so by about one per round of requests. A 429 or 5xx
+    response, or a connection error, halves the limit, at most once per DECREASE_INTERVAL so that a burst of
+    errors from one overloaded moment counts once. A Retry-After header (or, lacking one, the retry backoff) also
+    holds off new requests to the host until it has passed.
+
+    The controller only holds the state; the engines guard it with their own lock or condition and wait on it.
+
+    Args:
+        initial (int): The starting limit.
+        maximum (int): The highest the limit may go.
+    """
+
+    def __init__(self, initial, maximum):
+        self.limit = float(min(initial, maximum))
+        self.maximum = maximum
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._fastest = None
+        self._last_decrease = 0.0
+        self._multiplexed = False
+
+    def can_start(self, now):
+        """Returns True if a request may start at monotonic time 'now'."""
+
+        return self.in_flight < int(self.limit) and now >= self.blocked_until
+
+    def wait_time(self, now):
+        """Returns how long to wait before 'can_start' may change, or None to wait for a request to finish."""
+
+        return self.blocked_until - now if now < self.blocked_until else None
+
+    def on_response(self, latency, congested, retry_after=None):
+        """
+        Updates the limit after a request.
+
+        Args:
+            latency (float): The time to first byte in seconds, or None if no response was received.
+            congested (bool): True if the host answered 429 or 5xx, or the request failed.
+            retry_after (float): Seconds to hold off new requests to the host, if any.
+        """
+
+        now = time.monotonic()
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        if congested:
+            if now - self._last_decrease >= DECREASE_INTERVAL:
+                self.limit = max(1.0, self.limit / 2)
+                self._last_decrease = now
+            return
+        self._fastest = (
+            latency if self._fastest is None else min(self._fastest, latency)
+        )
+        if latency <= self._fastest * LATENCY_TOLERANCE:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_multiplexed(self):
+        """Raises the limit to the maximum the first time the host answers over a multiplexed (HTTP/2) connection."""
+
+        if not self._multiplexed:
+            self._multiplexed = True
+            self.limit = float(self.maximum)
+
+    def status(self):
+        """Returns the in-flight count and limit for progress output."""
+
+        return f"{self.in_flight}/{int(self.limit)} in flight"
+
+
+class Metrics:
+    """
+    Collects the wall time of each stage of a run and the timings of each image request, for '--metrics-json'.
+
+    Stages are timed with 'stage' and add up across chapters. They overlap where the work does: gallery pages are
+    fetched and parsed while the images of earlier pages download, so the stage times can add up to more than
+    the wall time of the run. It is safe to use from any thread.
+
+    Example:
+        metrics = Metrics()
+        with metrics.stage("parse"):
+            image_sources = extract_image_sources(html)
+        metrics.write("metrics.json")
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.images = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Adds the time spent in the 'with' block to the stage 'name'."""
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.stages[name] += elapsed
+
+    def add_image(self, img_url, **timing):
+        """
+        Records one image request.
+
+        Args:
+            img_url (str): The URL of the image.
+            **timing: The 'status', number of 'retries', 'bytes' received, 'error' if the request failed, and the
+                'connect' (including DNS resolution), 'ttfb' (time to first byte, from sending the request to
+                receiving the response headers) and 'transfer' (from the headers to the end of the body) times
+                in seconds. Times the engine can't measure are None.
+        """
+
+        with self._lock:
+            self.images.append({"url": img_url, **timing})
+
+    def summary(self):
+        """Returns the collected metrics as a JSON-serializable dict."""
+
+        with self._lock:
+            images = list(self.images)
+            stages = dict(self.stages)
+        return {
+            "wall_time": time.perf_counter() - self.started,
+            "stages": stages,
+            "requests": len(images),
+            "retries": sum(image["retries"] for image in images),
+            "bytes": sum(image["bytes"] or 0 for image in images),
+            "images": images,
+        }
+
+    def write(self, path):
+        """Writes 'summary' to the JSON file 'path'."""
+
+        Path(path).write_text(
+            json.dumps(self.summary(), indent=2) + "\n", encoding="utf-8"
+        )
+        logging.info("Wrote metrics to %s", path)
+
+
+class TransferProgress:
+    """
+    Counts the images and bytes of a run as they stream in, for 'show_progress'.
+
+    Images are counted as they are found, start transferring once their response headers arrive, and finish
+    when their body has been read or the request failed. Bytes are counted chunk by chunk. It is safe to use
+    from any thread.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.images_found = 0
+        self.images_started = 0
+        self.images_done = 0
+        self.in_flight = 0
+        self.bytes_done = 0
+        self.bytes_expected = 0
+        self._sized = 0
+        self._lock = threading.Lock()
+
+    def found(self):
+        """Counts an image that is going to be downloaded."""
+
+        with self._lock:
+            self.images_found += 1
+
+    def start(self, content_length):
+        """Counts an image whose response headers arrived, with its Content-Length header value, if any."""
+
+        with self._lock:
+            self.images_started += 1
+            self.in_flight += 1
+            if content_length and content_length.isdigit():
+                self.bytes_expected += int(content_length)
+                self._sized += 1
+
+    def advance(self, nbytes):
+        """Counts 'nbytes' bytes received."""
+
+        with self._lock:
+            self.bytes_done += nbytes
+
+    def track(self, chunks):
+        """Yields the items of 'chunks', counting their lengths as they pass."""
+
+        for chunk in chunks:
+            self.advance(len(chunk))
+            yield chunk
+
+    def finish(self):
+        """Counts an image whose transfer ended, successfully or not."""
+
+        with self._lock:
+            self.in_flight -= 1
+            self.images_done += 1
+
+    def snapshot(self):
+        """
+        Returns the current totals and rates.
+
+        Returns:
+            dict: The 'images_done', 'images_found', 'in_flight' and 'bytes_done' counts, the 'bytes_total'
+            estimate, the 'bytes_per_second' and 'images_per_second' rates and the 'eta' in seconds, which is
+            None until it can be estimated. The total counts the Content-Length of every image that started, and
+            the average of those for the images that haven't started yet.
+        """
+
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            bytes_total = None
+            if self._sized:
+                average = self.bytes_expected / self._sized
+                unstarted = self.images_found - self.images_started
+                bytes_total = max(
+                    self.bytes_done, round(self.bytes_expected + unstarted * average)
+                )
+            bytes_per_second = self.bytes_done / elapsed if elapsed else 0
+            eta = None
+            if bytes_total is not None and bytes_per_second:
+                eta = (bytes_total - self.bytes_done) / bytes_per_second
+            return {
+                "images_done": self.images_done,
+                "images_found": self.images_found,
+                "in_flight": self.in_flight,
+                "bytes_done": self.bytes_done,
+                "bytes_total": bytes_total,
+                "bytes_per_second": bytes_per_second,
+                "images_per_second": self.images_done / elapsed if elapsed else 0,
+                "eta": eta,
+            }
+
+
+@contextmanager
+def show_progress(progress, console=None):
+    """
+    Shows a 'TransferProgress' while the 'with' block runs.
+
+    On a terminal, a live progress bar shows the bytes received against the estimated total, MB/s, images per
+    second, the number of images in flight and the ETA, and log messages are printed above it. Otherwise, such
+    as when the output is redirected to a file, the same figures are logged every PROGRESS_INTERVAL seconds.
+
+    Args:
+        progress (TransferProgress): The counts to show.
+        console (rich.console.Console): The console to draw on. Defaults to standard output.
+
+    Example:
+        with Downloader() as downloader, show_progress(downloader.progress):
+            build_cbz("https://example.com/gallery", "comic.cbz", downloader)
+    """
+
+    console = console or Console()
+    stop = threading.Event()
+    if not console.is_terminal:
+
+        def log_progress():
+            while not stop.wait(PROGRESS_INTERVAL):
+                stats = progress.snapshot()
+                logging.info(
+                    "Progress: %s of %s images, %.1f MB, %.1f MB/s, %.1f images/s, %s in flight, ETA %s",
+                    stats["images_done"],
+                    stats["images_found"],
+                    stats["bytes_done"] / 1_000_000,
+                    stats["bytes_per_second"] / 1_000_000,
+                    stats["images_per_second"],
+                    stats["in_flight"],
+                    "unknown" if stats["eta"] is None else f"{stats['eta']:.0f}s",
+                )
+
+        reporter = threading.Thread(target=log_progress, name="progress", daemon=True)
+        reporter.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            reporter.join()
+        return
+
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    root.handlers = [RichHandler(console=console, show_path=False)]
+    display = Progress(
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        DownloadColumn(),
+        TransferSpeedColumn(),
+        TextColumn("{task.fields[images]} images"),
+        TextColumn("{task.fields[images_per_second]:.1f} images/s"),
+        TextColumn("{task.fields[in_flight]} in flight"),
+        TimeRemainingColumn(),
+        console=console,
+    )
+    task = display.add_task(
+        "Downloading", total=None, images="0/0", images_per_second=0, in_flight=0
+    )
+
+    def update():
+        stats = progress.snapshot()
+        display.update(
+            task,
+            completed=stats["bytes_done"],
+            total=stats["bytes_total"],
+            images=f"{stats['images_done']}/{stats['images_found']}",
+            images_per_second=stats["images_per_second"],
+            in_flight=stats["in_flight"],
+        )
+
+    def refresh():
+        while not stop.wait(0.2):
+            update()
+
+    refresher = threading.Thread(target=refresh, name="progress", daemon=True)
+    try:
+        with display:
+            refresher.start()
+            try:
+                yield
+            finally:
+                stop.set()
+                refresher.join()
+                update()
+    finally:
+        root.handlers = handlers
+
+
+class Downloader:
+    """
+    Shared state for downloading images, meant to live for a whole run and be reused by every chapter in it.
+
+    It holds one pooled session for images, so keep-alive connections are shared across chapters, and runs downloads
+    on one thread pool per host. Gallery pages are fetched with 'page_session', which, unlike the image session,
+    lets urllib3 wait out a Retry-After on 429 and 503 responses. A global semaphore caps the number of downloads in
+    flight across all hosts at 'max_downloads'. Within that, a 'HostController' per host adapts how many of the host
+    pool's 'max_per_host' threads may have a request in flight, starting from MAX_WORKERS. It backs off when the
+    host answers 429 or 5xx and grows while responses stay fast. Totals of images and bytes downloaded are kept for
+    the summary logged by 'close', and the stage and request timings of the run in 'metrics'. Chapters that
+    transcode their pages share the process pool returned by 'transcoder', so worker processes are started once per
+    run.
+
+    Args:
+        max_downloads (int): The maximum number of concurrent downloads overall. Defaults to MAX_DOWNLOADS.
+        max_per_host (int): The most concurrent downloads a single host's limit may grow to. Defaults to
+            MAX_PER_HOST.
+        cache (ImageCache): A cache to revalidate images against before downloading them. It is closed along
+            with the downloader.
+
+    Example:
+        with Downloader() as downloader:
+            download_images("https://example.com/gallery/1", downloader)
+            download_images("https://example.com/gallery/2", downloader)
+    """
+
+    def __init__(
+        self, max_downloads=MAX_DOWNLOADS, max_per_host=MAX_PER_HOST, cache=None
+    ):
+        # Throttling is left to the HostController, which can't see urllib3 sleeping on a Retry-After
+        self.session = backoff_retry_session(
+            pool_size=max_per_host, respect_retry_after=False
+        )
+        # Gallery pages aren't fetched under the HostController, so urllib3 waits out a Retry-After for them
+        self.page_session = backoff_retry_session()
+        self.cache = cache
+        self.images = 0
+        self.bytes = 0
+        self.metrics = Metrics()
+        self.progress = TransferProgress()
+        self.started = time.perf_counter()
+        self._max_per_host = max_per_host
+        self._slots = threading.BoundedSemaphore(max_downloads)
+        self._executors = {}
+        self._transcoder = None
+        self._controllers = defaultdict(
+            lambda: HostController(MAX_WORKERS, max_per_host)
+        )
+        self._lock = threading.Lock()
+        self._host_ready = threading.Condition(self._lock)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def download(self, img_url, save_directory, known=None):
+        """
+        Schedules 'download_image' for an image and returns its future, which resolves to the page record.
+
+        'known' is the 'Manifest' entry of an earlier download of the image, to revalidate instead of downloading
+        it again if it hasn't changed.
+        """
+
+        return self._submit(download_image, img_url, save_directory, self, known)
+
+    def fetch(self, img_url, process=None):
+        """
+        Schedules 'fetch_image' for an image and returns its future.
+
+        If given, 'process' is called with the image body on the worker thread and the future resolves to its
+        result instead of the body.
+        """
+
+        return self._submit(self._fetch, img_url, process)
+
+    def _fetch(self, img_url, process):
+        data = fetch_image(img_url, self)
+        return process(data) if process else data
+
+    def transcoder(self):
+        """
+        Returns the process pool that pages are transcoded on, starting it on first use. It is shared by every
+        chapter of the run and shut down by 'close'.
+        """
+
+        with self._lock:
+            if self._transcoder is None:
+                self._transcoder = ProcessPoolExecutor()
+            return self._transcoder
+
+    def conditional_headers(self, img_url):
+        """Returns the headers revalidating the cached copy of 'img_url', if there is one."""
+
+        return self.cache.conditional_headers(img_url) if self.cache else {}
+
+    def host_status(self, img_url):
+        """Returns the in-flight count and current limit of the host of 'img_url' for progress output."""
+
+        return self._controllers[urlsplit(img_url).netloc].status()
+
+    @contextmanager
+    def request(self, img_url, headers=None):
+        """
+        Sends a GET request for an image, with the given conditional 'headers' or else the cache's, and yields the
+        unread response.
+
+        The request waits for its host's 'HostController' to allow it, then for one of the 'max_downloads' slots,
+        and holds both until the body has been read. Errors retried inside the session by urllib3 count as
+        congestion too. 429 and 503 responses are retried here up to RETRIES times, once the Retry-After delay
+        has passed; neither the host nor the slot is held while waiting it out.
+
+        The request is added to 'metrics' once it is done. urllib3 doesn't report when a connection is set up, so
+        that time is part of the TTFB here.
+        """
+
+        controller = self._controllers[urlsplit(img_url).netloc]
+        retry_count = 0
+        for attempt in range(RETRIES + 1):
+            self._acquire(controller)
+            started = time.perf_counter()
+            try:
+                img_response = self.session.get(
+                    img_url,
+                    headers=(
+                        self.conditional_headers(img_url)
+                        if headers is None
+                        else headers
+                    ),
+                    stream=True,
+                )
+            except requests.RequestException as error:
+                self._release(controller, None, True)
+                self.metrics.add_image(
+                    img_url,
+                    status=None,
+                    retries=retry_count,
+                    bytes=None,
+                    error=str(error),
+                    connect=None,
+                    ttfb=None,
+                    transfer=None,
+                )
+                raise
+            latency = time.perf_counter() - started
+
+            retries = img_response.raw.retries
+            history = retries.history if retries else ()
+            retry_count += len(history)
+            statuses = [img_response.status_code] + [entry.status for entry in history]
+            congested = any(
+                status and (status >= 500 or status in THROTTLE_STATUSES)
+                for status in statuses
+            )
+            if img_response.status_code in THROTTLE_STATUSES and attempt < RETRIES:
+                retry_after = parse_retry_after(img_response.headers.get("Retry-After"))
+                img_response.close()
+                self._release(
+                    controller,
+                    latency,
+                    True,
+                    retry_after or BACKOFF_FACTOR * 2**attempt,
+                )
+                retry_count += 1
+                continue
+
+            error = None
+            self.progress.start(img_response.headers.get("Content-Length"))
+            try:
+                with img_response:
+                    yield img_response
+            except BaseException as exception:
+                error = str(exception) or type(exception).__name__
+                raise
+            finally:
+                self.progress.finish()
+                self._release(controller, latency, congested)
+                self.metrics.add_image(
+                    img_url,
+                    status=img_response.status_code,
+                    retries=retry_count,
+                    bytes=img_response.raw.tell(),
+                    error=error,
+                    connect=None,
+                    ttfb=latency,
+                    transfer=time.perf_counter() - started - latency,
+                )
+            return
+
+    def _acquire(self, controller):
+        """
+        Waits for the host's controller to allow a request, and only then takes one of the 'max_downloads' slots,
+        so requests held back by a throttled host leave the slots to other hosts.
+        """
+
+        with self._host_ready:
+            while not controller.can_start(now := time.monotonic()):
+                self._host_ready.wait(controller.wait_time(now))
+            controller.in_flight += 1
+        self._slots.acquire()
+
+    def _release(self, controller, latency, congested, retry_after=None):
+        self._slots.release()
+        with self._host_ready:
+            controller.in_flight -= 1
+            controller.on_response(latency, congested, retry_after)
+            self._host_ready.notify_all()
+
+    def _submit(self, fn, img_url, *args):
+        """Schedules fn(img_url, *args) on the worker pool of the image's host and returns its future."""
+
+        host = urlsplit(img_url).netloc
+        with self._lock:
+            executor = self._executors.get(host)
+            if executor is None:
+                executor = self._executors[host] = ThreadPoolExecutor(
+                    max_workers=self._max_per_host, thread_name_prefix=host
+                )
+        return executor.submit(fn, img_url, *args)
+
+    def record(self, nbytes):
+        """Adds a finished image of 'nbytes' bytes to the run totals."""
+
+        with self._lock:
+            self.images += 1
+            self.bytes += nbytes
+
+    def close(self):
+        """Waits for outstanding downloads, closes the session and logs the run totals."""
+
+        for executor in self._executors.values():
+            executor.shutdown()
+        # Downloads finishing above may still have handed their pages to the transcoder
+        if self._transcoder:
+            self._transcoder.shutdown()
+        log_connection_stats(self.session)
+        self.session.close()
+        self.page_session.close()
+        if self.cache:
+            self.cache.close()
+
+        elapsed = time.perf_counter() - self.started
+        megabytes = self.bytes / 1_000_000
+        logging.info(
+            "Downloaded %s images (%.1f MB) in %.2fs: %.1f MB/s, %.1f images/s",
+            self.images,
+            megabytes,
+            elapsed,
+            megabytes / elapsed if elapsed else 0,
+            self.images / elapsed if elapsed else 0,
+        )
+
+
+def page_record(filename, size, headers, digest):
+    """
+    Describes a downloaded image for the 'Manifest'.
+
+    Args:
+        filename (str): The name the image was saved under.
+        size (int): The size of the image in bytes.
+        headers (Mapping): The response headers the image was served with.
+        digest (hashlib._Hash): A SHA-256 hash object fed with the image body.
+
+    Returns:
+        dict: The filename, size, ETag and Last-Modified headers and hex SHA-256 of the image.
+    """
+
+    return {
+        "file": filename,
+        "size": size,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "sha256": digest.hexdigest(),
+    }
+
+
+class Manifest:
+    """
+    An append-only record of the images already downloaded into a directory, used to resume interrupted
+    downloads.
+
+    The manifest is kept as JSON lines in MANIFEST_NAME inside the directory, one 'page_record' per line with the
+    image URL added. Each record is appended as soon as its image is in place, so the manifest survives a crash
+    at any point; a torn last line is ignored and the latest record for a URL wins.
+
+    Args:
+        directory (str): The directory the images are downloaded into.
+
+    Example:
+        manifest = Manifest("/path/to/comic.cbz.pages")
+        if not manifest.is_complete("https://example.com/uploads/page-01.jpg"):
+            ...
+        headers = manifest.validators("https://example.com/uploads/page-01.jpg")
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry["url"]] = entry
+
+    def is_complete(self, img_url):
+        """Returns True if 'img_url' was downloaded before and its file is still intact."""
+
+        entry = self.entries.get(img_url)
+        if entry is None:
+            return False
+        path = os.path.join(self.directory, entry["file"])
+        try:
+            if os.path.getsize(path) != entry["size"]:
+                return False
+            with open(path, "rb") as f:
+                return hashlib.file_digest(f, "sha256").hexdigest() == entry["sha256"]
+        except FileNotFoundError:
+            return False
+
+    def validators(self, img_url):
+        """
+        Returns the conditional request headers revalidating the recorded download of 'img_url' with the server,
+        so a page that changed since is fetched again. Empty if the server sent no ETag or Last-Modified header.
+        """
+
+        entry = self.entries[img_url]
+        return validator_headers(entry.get("etag"), entry.get("last_modified"))
+
+    def add(self, img_url, record):
+        """Records that 'img_url' has been downloaded, as described by 'record'."""
+
+        entry = {"url": img_url, **record}
+        self.entries[img_url] = entry
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+@contextmanager
+def atomic_write(save_path):
+    """
+    Opens a hidden '.part' file next to 'save_path' for writing and moves it into place when the block completes.
+
+    Args:
+        save_path (str): The final path of the file.
+
+    Yields:
+        file: The '.part' file, opened in binary mode.
+
+    If the block raises, the '.part' file is removed and 'save_path' is left untouched, so readers never see a
+    partly written file.
+
+    Example:
+        with atomic_write("/path/to/image.jpg") as f:
+            f.write(data)
+    """
+
+    save_directory, filename = os.path.split(save_path)
+    fd, part_path = tempfile.mkstemp(
+        dir=save_directory, prefix=f".{filename}.", suffix=PART_SUFFIX
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.replace(part_path, save_path)
+    except BaseException:
+        os.unlink(part_path)
+        raise
+
+
+def validator_headers(etag, last_modified):
+    """
+    Builds the conditional request headers revalidating a cached response.
+
+    Args:
+        etag (str): The ETag the response was served with, if any.
+        last_modified (str): The Last-Modified header the response was served with, if any.
+
+    Returns:
+        dict: If-None-Match and If-Modified-Since headers for the validators present.
+    """
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+class ImageCache:
+    """
+    An on-disk cache of downloaded images and gallery pages, shared between runs.
+
+    Image bodies are stored once per distinct content under 'blobs/<sha256>', so the same page served from several
+    URLs takes space only once. An SQLite index maps each URL to its blob and the ETag and Last-Modified headers
+    it was served with. These are sent back as If-None-Match and If-Modified-Since, and a 304 response means the
+    cached blob is used instead of the body being transferred again. When the blobs grow beyond 'max_size', the
+    least recently used ones are evicted. Hits (revalidated images) and misses (full downloads) are counted for
+    the summary logged by 'close'.
+
+    Gallery pages are kept in the index too, with their validators, the image sources extracted from them and
+    their next-page link for each set of selectors, so an unchanged page does not have to be parsed again.
+
+    The cache is safe to use from several threads.
+
+    Args:
+        directory (str): The directory to keep the cache in. It is created if missing.
+        max_size (int): The maximum total size of the cached blobs in bytes. Defaults to CACHE_MAX_SIZE.
+
+    Example:
+        with Downloader(cache=ImageCache("~/.cache/cbz-from-webpage")) as downloader:
+            download_images("https://example.com/gallery", downloader)
+    """
+
+    def __init__(self, directory, max_size=CACHE_MAX_SIZE):
+        self.directory = Path(directory).expanduser()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        (self.directory / "blobs").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            self.directory / "index.sqlite", check_same_thread=False
+        )
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY, size INTEGER, last_used REAL
+            );
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY, sha256 TEXT, etag TEXT, last_modified TEXT
+            );
+            CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body BLOB,
+                image_sources TEXT
+            );
+            CREATE TABLE IF NOT EXISTS next_pages (
+                url TEXT, selectors TEXT, next_url TEXT, PRIMARY KEY (url, selectors)
+            );
+            """)
+        (self._size,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()
+        # Apply a cap lowered since the last run
+        self._evict()
+        self._db.commit()
+
+    def conditional_headers(self, img_url):
+        """
+        Returns the headers revalidating the cached copy of 'img_url', or none if it isn't cached. An entry whose
+        blob has gone missing is dropped, so the image is fetched in full instead of revalidated.
+        """
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256, etag, last_modified FROM urls"
+                " JOIN blobs USING (sha256) WHERE url = ?",
+                (img_url,),
+            ).fetchone()
+            if row is None or not self._blob_path(row[0]).exists():
+                self._forget(img_url)
+                return {}
+        return validator_headers(row[1], row[2])
+
+    def page(self, url):
+        """Returns the cached gallery page at 'url' as a 'CachedPage', or None if it isn't cached."""
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified, body, image_sources FROM pages"
+                " WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, body, image_sources = row
+        headers = validator_headers(etag, last_modified)
+        # A page without validators can't be revalidated, so don't let it shadow a fresh fetch
+        if not headers:
+            return None
+        return CachedPage(headers, body, json.loads(image_sources))
+
+    def store_page(self, url, body, headers, image_sources):
+        """Adds the gallery page 'body' served from 'url' with 'headers', and its image sources, to the cache."""
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                (
+                    url,
+                    headers.get("ETag"),
+                    headers.get("Last-Modified"),
+                    body,
+                    json.dumps(image_sources),
+                ),
+            )
+            self._db.commit()
+
+    def next_page(self, url, selectors):
+        """
+        Returns the next-page link 'selectors' found in the cached gallery page at 'url': None if it isn't cached,
+        and an empty string if the page has no next page.
+        """
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT next_url FROM next_pages WHERE url = ? AND selectors = ?",
+                (url, json.dumps(selectors)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def store_next_page(self, url, selectors, next_url):
+        """Records the next-page link 'selectors' found in the gallery page at 'url', or None if there is none."""
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO next_pages VALUES (?, ?, ?)",
+                (url, json.dumps(selectors), next_url or ""),
+            )
+            self._db.commit()
+
+    def restore(self, img_url, save_path):
+        """
+        Places the cached copy of 'img_url' at 'save_path', as a hard link where possible, and returns its
+        'page_record'.
+
+        Returns None if the copy has gone missing since it was revalidated, evicted by another thread or deleted
+        by hand. Its entry is dropped then, so fetching the image again downloads it in full.
+        """
+
+        hit = self._hit(img_url, os.path.basename(save_path))
+        if hit is None:
+            return None
+        record, blob_path = hit
+        save_directory, filename = os.path.split(save_path)
+        link_path = os.path.join(save_directory, f".{filename}.link{PART_SUFFIX}")
+        try:
+            os.link(blob_path, link_path)
+            os.replace(link_path, save_path)
+        except OSError:
+            try:
+                with open(blob_path, "rb") as src, atomic_write(save_path) as dest:
+                    shutil.copyfileobj(src, dest, CHUNK_SIZE)
+            except FileNotFoundError:
+                with self._lock:
+                    self._forget(img_url)
+                return None
+        return record
+
+    def read(self, img_url):
+        """Returns the cached body of 'img_url', or None if it has gone missing, as for 'restore'."""
+
+        hit = self._hit(img_url, img_url.split("/")[-1])
+        if hit is None:
+            return None
+        try:
+            return hit[1].read_bytes()
+        except FileNotFoundError:
+            with self._lock:
+                self._forget(img_url)
+            return None
+
+    def store_file(self, img_url, path, record):
+        """Adds the image downloaded from 'img_url' to 'path', described by 'record', to the cache."""
+
+        blob_path = self._blob_path(record["sha256"])
+        if not blob_path.exists():
+            try:
+                os.link(path, blob_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                with open(path, "rb") as src, atomic_write(blob_path) as dest:
+                    shutil.copyfileobj(src, dest, CHUNK_SIZE)
+        self._store(img_url, record)
+
+    def store_bytes(self, img_url, data, record):
+        """Adds the image body 'data' downloaded from 'img_url', described by 'record', to the cache."""
+
+        blob_path = self._blob_path(record["sha256"])
+        if not blob_path.exists():
+            with atomic_write(blob_path) as f:
+                f.write(data)
+        self._store(img_url, record)
+
+    def close(self):
+        """Closes the index and logs the hit and miss counts."""
+
+        self._db.close()
+        logging.info("Image cache: %s hits, %s misses", self.hits, self.misses)
+
+    def _blob_path(self, sha256):
+        return self.directory / "blobs" / sha256
+
+    def _hit(self, img_url, filename):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT urls.sha256, size, etag, last_modified FROM urls"
+                " JOIN blobs USING (sha256) WHERE url = ?",
+                (img_url,),
+            ).fetchone()
+            if row is None or not self._blob_path(row[0]).exists():
+                self._forget(img_url)
+                return None
+            sha256, size, etag, last_modified = row
+            self._db.execute(
+                "UPDATE blobs SET last_used = ? WHERE sha256 = ?", (time.time(), sha256)
+            )
+            self._db.commit()
+            self.hits += 1
+        record = {
+            "file": filename,
+            "size": size,
+            "etag": etag,
+            "last_modified": last_modified,
+            "sha256": sha256,
+        }
+        return record, self._blob_path(sha256)
+
+    def _store(self, img_url, record):
+        with self._lock:
+            self.misses += 1
+            self._db.execute(
+                "INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)",
+                (img_url, record["sha256"], record["etag"], record["last_modified"]),
+            )
+            inserted = self._db.execute(
+                "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)",
+                (record["sha256"], record["size"], time.time()),
+            ).rowcount
+            self._size += record["size"] if inserted else 0
+            self._evict()
+            self._db.commit()
+
+    def _forget(self, img_url):
+        """
+        Drops the entry of 'img_url', and the record of its blob if the file is gone. Called with the lock held.
+        """
+
+        row = self._db.execute(
+            "SELECT sha256, size FROM urls JOIN blobs USING (sha256) WHERE url = ?",
+            (img_url,),
+        ).fetchone()
+        self._db.execute("DELETE FROM urls WHERE url = ?", (img_url,))
+        if row and not self._blob_path(row[0]).exists():
+            self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (row[0],))
+            self._size -= row[1]
+        self._db.commit()
+
+    def _evict(self):
+        """Removes the least recently used blobs, and the URLs pointing to them, until the cache fits."""
+
+        while self._size > self.max_size:
+            sha256, size = self._db.execute(
+                "SELECT sha256, size FROM blobs ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            self._db.execute("DELETE FROM urls WHERE sha256 = ?", (sha256,))
+            self._blob_path(sha256).unlink(missing_ok=True)
+            self._size -= size
+
+
+def write_chunk(f, digest, chunk):
+    """Writes 'chunk' of a response body to 'f' and adds it to 'digest'."""
+
+    f.write(chunk)
+    digest.update(chunk)
+
+
+def download_image(img_url, save_directory, downloader, known=None):
     """
     Downloads an image from the specified URL and saves it to the given directory.
 
     Args:
         img_url (str): The URL of the image to download.
         save_directory (str): The directory where the downloaded image will be saved.
+        downloader (Downloader): The shared download state, whose session is used so that keep-alive
+            connections are reused between images.
+        known (dict): The 'Manifest' entry of an earlier download of the image into 'save_directory'. If given,
+            the request revalidates it with its ETag and Last-Modified instead.
 
     Returns:
-        None
+        dict: The 'page_record' of the image.
 
     Raises:
-        Any exceptions raised during the download process will be propagated.
+        requests.HTTPError: If the server answers with an error status.
+        Any other exceptions raised during the download process will be propagated.
+
+    The function downloads an image from the provided URL using a GET request on the given session. The response
+    body is streamed in CHUNK_SIZE pieces into a hidden '.part' file next to the final path, so memory use does not
+    grow with the image size, and hashed on the way through. Only once the whole body has been written is the file
+    renamed into place; a failed download removes its '.part' file and never leaves a truncated image behind.
 
-    The function downloads an image from the provided URL using a GET request with backoff and retry
-    functionality. The image is then saved to the specified directory.
+    If the downloader has an 'ImageCache', the request revalidates the cached copy and a 304 response restores it
+    from the cache instead. Freshly downloaded images are added to the cache. An image revalidated against 'known'
+    is left in place on a 304 response, and replaced if it changed on the server.
 
     Example:
-        download_image("https://example.com/image.jpg", "/path/to/save/directory")
+        with Downloader() as downloader:
+            download_image("https://example.com/image.jpg", "/path/to/save/directory", downloader)
 
     """
 
     # Extract the filename from the image URL
     filename = img_url.split("/")[-1]
 
+    save_path = os.path.join(save_directory, filename)
+
     # Send a GET request to the image URL with backoff and retry
-    with backoff_retry_session() as session:
-        img_response = session.get(img_url)
+    headers = known and validator_headers(known.get("etag"), known.get("last_modified"))
+    while True:
+        with downloader.request(img_url, headers) as img_response:
+            img_response.raise_for_status()
+            if img_response.status_code == 304:
+                if known:
+                    logging.info("Unchanged: %s", filename)
+                    return known
+                record = downloader.cache.restore(img_url, save_path)
+                if record is None:
+                    logging.warning(
+                        "Cached copy of %s is gone, fetching it again", filename
+                    )
+                    continue
+                logging.info("Cached: %s", filename)
+                return record
+            size = 0
+            digest = hashlib.sha256()
+
+            # Stream the body to a temporary file and move it into place once complete
+            with atomic_write(save_path) as f:
+                chunks = img_response.iter_content(chunk_size=CHUNK_SIZE)
+                for chunk in downloader.progress.track(chunks):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            host_status = downloader.host_status(img_url)
+        break
+    downloader.record(size)
+    logging.info("Downloaded: %s (%s)", filename, host_status)
+    record = page_record(filename, size, img_response.headers, digest)
+    if downloader.cache:
+        downloader.cache.store_file(img_url, save_path, record)
+    return record
+
+
+def fetch_image(img_url, downloader):
+    """
+    Downloads an image from the specified URL into memory.
 
-    # Save the image to the specified directory
-    save_path = os.path.join(save_directory, filename)
-    with open(save_path, "wb") as f:
-        f.write(img_response.content)
-    logging.info("Downloaded: %s", filename)
+    Args:
+        img_url (str): The URL of the image to download.
+        downloader (Downloader): The shared download state, whose session is used to send the request.
+
+    Returns:
+        bytes: The body of the image.
+
+    Raises:
+        requests.HTTPError: If the server answers with an error status.
+        Any other exceptions raised during the download process will be propagated.
+
+    Like 'download_image', the downloader's 'ImageCache' is revalidated and updated if it has one.
+
+    Example:
+        with Downloader() as downloader:
+            data = fetch_image("https://example.com/image.jpg", downloader)
+    """
+
+    filename = img_url.split("/")[-1]
+    while True:
+        with downloader.request(img_url) as img_response:
+            img_response.raise_for_status()
+            if img_response.status_code == 304:
+                data = downloader.cache.read(img_url)
+                if data is None:
+                    logging.warning(
+                        "Cached copy of %s is gone, fetching it again", filename
+                    )
+                    continue
+                logging.info("Cached: %s", filename)
+                return data
+            chunks = img_response.iter_content(chunk_size=CHUNK_SIZE)
+            data = b"".join(downloader.progress.track(chunks))
+            host_status = downloader.host_status(img_url)
+        break
+    downloader.record(len(data))
+    logging.info("Downloaded: %s (%s)", filename, host_status)
+    if downloader.cache:
+        record = page_record(
+            filename, len(data), img_response.headers, hashlib.sha256(data)
+        )
+        downloader.cache.store_bytes(img_url, data, record)
+    return data
+
+
+class AsyncDownloader(Downloader):
+    """
+    A 'Downloader' that runs image downloads as coroutines instead of one thread per request.
+
+    All downloads share one httpx.AsyncClient on an event loop running in a background thread, so an in-flight
+    request costs a coroutine and a buffer rather than a thread. Concurrency is bounded by an asyncio semaphore
+    of 'max_downloads' overall and by the same adaptive 'HostController' per host as the threaded engine.
+    Requests are retried on the same statuses and with the same backoff as 'backoff_retry_session', and on 429
+    and 503 once the Retry-After delay has passed. The futures returned by 'download' and 'fetch' are ordinary
+    concurrent.futures.Future objects, so callers can't tell the engines apart. Gallery pages are still fetched
+    with the requests 'page_session'.
+
+    Args:
+        max_downloads (int): The maximum number of concurrent downloads overall. Defaults to MAX_DOWNLOADS.
+        max_per_host (int): The most concurrent downloads a single host's limit may grow to. Defaults to
+            MAX_PER_HOST.
+        cache (ImageCache): A cache to revalidate images against before downloading them. It is closed along
+            with the downloader.
+
+    Example:
+        with AsyncDownloader(max_downloads=200) as downloader:
+            download_images("https://example.com/gallery", downloader)
+    """
+
+    def __init__(
+        self, max_downloads=MAX_DOWNLOADS, max_per_host=MAX_PER_HOST, cache=None
+    ):
+        super().__init__(max_downloads, max_per_host, cache)
+        self.protocols = Counter()
+        self._client = self._make_client(max_downloads)
+        self._download_slots = asyncio.Semaphore(max_downloads)
+        self._host_ready_async = asyncio.Condition()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="downloader", daemon=True
+        )
+        self._thread.start()
+
+    def download(self, img_url, save_directory, known=None):
+        return self._schedule(self._download(img_url, save_directory, known))
+
+    def fetch(self, img_url, process=None):
+        return self._schedule(self._fetch_async(img_url, process))
+
+    def close(self):
+        self._schedule(self._client.aclose()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        if self.protocols:
+            logging.info(
+                "Image responses by protocol: %s",
+                ", ".join(f"{name} {count}" for name, count in self.protocols.items()),
+            )
+        super().close()
+
+    def _make_client(self, max_downloads):
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_downloads,
+                max_keepalive_connections=max_downloads,
+            ),
+            follow_redirects=True,
+        )
+
+    def _schedule(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _download(self, img_url, save_directory, known=None):
+        filename = img_url.split("/")[-1]
+        save_path = os.path.join(save_directory, filename)
+        size = 0
+        digest = hashlib.sha256()
+        headers = known and validator_headers(
+            known.get("etag"), known.get("last_modified")
+        )
+        while True:
+            async with self._stream(img_url, headers) as img_response:
+                if img_response.status_code == 304:
+                    if known:
+                        logging.info("Unchanged: %s", filename)
+                        return known
+                    record = await self._in_thread(
+                        self.cache.restore, img_url, save_path
+                    )
+                    if record is None:
+                        logging.warning(
+                            "Cached copy of %s is gone, fetching it again", filename
+                        )
+                        continue
+                    logging.info("Cached: %s", filename)
+                    return record
+                writer = atomic_write(save_path)
+                f = await self._in_thread(writer.__enter__)
+                try:
+                    async for chunk in img_response.aiter_bytes(CHUNK_SIZE):
+                        self.progress.advance(len(chunk))
+                        await self._in_thread(write_chunk, f, digest, chunk)
+                        size += len(chunk)
+                except BaseException:
+                    await self._in_thread(writer.__exit__, *sys.exc_info())
+                    raise
+                await self._in_thread(writer.__exit__, None, None, None)
+                host_status = self.host_status(img_url)
+            break
+        self.record(size)
+        logging.info("Downloaded: %s (%s)", filename, host_status)
+        record = page_record(filename, size, img_response.headers, digest)
+        if self.cache:
+            await self._in_thread(self.cache.store_file, img_url, save_path, record)
+        return record
+
+    async def _fetch_async(self, img_url, process):
+        filename = img_url.split("/")[-1]
+        while True:
+            async with self._stream(img_url) as img_response:
+                if img_response.status_code == 304:
+                    data = await self._in_thread(self.cache.read, img_url)
+                    if data is None:
+                        logging.warning(
+                            "Cached copy of %s is gone, fetching it again", filename
+                        )
+                        continue
+                    logging.info("Cached: %s", filename)
+                else:
+                    chunks = []
+                    async for chunk in img_response.aiter_bytes(CHUNK_SIZE):
+                        self.progress.advance(len(chunk))
+                        chunks.append(chunk)
+                    data = b"".join(chunks)
+                    self.record(len(data))
+                    logging.info(
+                        "Downloaded: %s (%s)", filename, self.host_status(img_url)
+                    )
+                    if self.cache:
+                        record = page_record(
+                            filename,
+                            len(data),
+                            img_response.headers,
+                            hashlib.sha256(data),
+                        )
+                        await self._in_thread(
+                            self.cache.store_bytes, img_url, data, record
+                        )
+            break
+        if process:
+            # Keep CPU work such as checksums off the event loop
+            return await self._in_thread(process, data)
+        return data
+
+    async def _in_thread(self, fn, *args):
+        """
+        Runs 'fn' on the loop's default executor. Disk and cache I/O goes through here, so that a slow write or an
+        SQLite commit doesn't stall every other download in flight.
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    @asynccontextmanager
+    async def _stream(self, img_url, headers=None):
+        """
+        Sends a GET request with retries, with the given conditional 'headers' or else the cache's, and yields the
+        checked, still unread, response.
+
+        The request is added to 'metrics' once it is done, with the time spent setting up a new connection taken
+        from httpx's trace extension.
+        """
+
+        controller = self._controllers[urlsplit(img_url).netloc]
+        events = {}
+
+        async def trace(event_name, info):
+            events.setdefault(event_name, time.perf_counter())
+
+        if headers is None:
+            headers = await self._in_thread(self.conditional_headers, img_url)
+        for attempt in range(RETRIES + 1):
+            await self._acquire_async(controller)
+            events.clear()
+            started = time.perf_counter()
+            try:
+                img_response = await self._client.send(
+                    self._client.build_request(
+                        "GET",
+                        img_url,
+                        headers=headers,
+                        extensions={"trace": trace},
+                    ),
+                    stream=True,
+                )
+            except httpx.TransportError as error:
+                await self._release_async(
+                    controller, None, True, BACKOFF_FACTOR * 2**attempt
+                )
+                if attempt == RETRIES:
+                    self.metrics.add_image(
+                        img_url,
+                        status=None,
+                        retries=attempt,
+                        bytes=None,
+                        error=str(error) or type(error).__name__,
+                        connect=connect_time(events),
+                        ttfb=None,
+                        transfer=None,
+                    )
+                    raise
+                continue
+            latency = time.perf_counter() - started
+            self.protocols[img_response.http_version] += 1
+            if img_response.http_version == "HTTP/2":
+                controller.on_multiplexed()
+
+            status = img_response.status_code
+            congested = status >= 500 or status in THROTTLE_STATUSES
+            retryable = status in RETRY_STATUSES or status in THROTTLE_STATUSES
+            if not retryable or attempt == RETRIES:
+                break
+            retry_after = parse_retry_after(img_response.headers.get("Retry-After"))
+            await img_response.aclose()
+            await self._release_async(
+                controller,
+                latency,
+                True,
+                retry_after or BACKOFF_FACTOR * 2**attempt,
+            )
+        error = None
+        self.progress.start(img_response.headers.get("Content-Length"))
+        try:
+            # Unlike requests, httpx treats 304 Not Modified as an error too
+            if img_response.is_error:
+                img_response.raise_for_status()
+            yield img_response
+        except BaseException as exception:
+            error = str(exception) or type(exception).__name__
+            raise
+        finally:
+            self.progress.finish()
+            await img_response.aclose()
+            await self._release_async(controller, latency, congested)
+            self.metrics.add_image(
+                img_url,
+                status=img_response.status_code,
+                retries=attempt,
+                bytes=img_response.num_bytes_downloaded,
+                error=error,
+                connect=connect_time(events),
+                ttfb=latency,
+                transfer=time.perf_counter() - started - latency,
+            )
+
+    async def _acquire_async(self, controller):
+        async with self._host_ready_async:
+            while not controller.can_start(now := time.monotonic()):
+                try:
+                    await asyncio.wait_for(
+                        self._host_ready_async.wait(), controller.wait_time(now)
+                    )
+                except TimeoutError:
+                    pass
+            controller.in_flight += 1
+        # Only take a slot once the host allows the request, as in 'Downloader._acquire'
+        try:
+            await self._download_slots.acquire()
+        except BaseException:
+            async with self._host_ready_async:
+                controller.in_flight -= 1
+                self._host_ready_async.notify_all()
+            raise
+
+    async def _release_async(self, controller, latency, congested, retry_after=None):
+        self._download_slots.release()
+        async with self._host_ready_async:
+            controller.in_flight -= 1
+            controller.on_response(latency, congested, retry_after)
+            self._host_ready_async.notify_all()
+
+
+def connect_time(events):
+    """
+    Returns the seconds a request spent setting up a new connection, DNS resolution and TLS handshake included,
+    from the event times recorded by an httpx trace callback, or None if it reused a connection.
+    """
+
+    started = events.get("connection.connect_tcp.started")
+    if started is None:
+        return None
+    finished = events.get(
+        "connection.start_tls.complete", events.get("connection.connect_tcp.complete")
+    )
+    return finished - started if finished else None
+
+
+class Http2Downloader(AsyncDownloader):
+    """
+    An 'AsyncDownloader' that multiplexes the downloads from each host over a single HTTP/2 connection.
+
+    With HTTP/1.1 every concurrent download needs a connection of its own, and so a TCP and TLS handshake of its
+    own. Over HTTP/2 they all become streams of one connection per host, negotiated with ALPN, which also keeps the
+    requests in flight from being capped by connection limits on the server side. As a new stream costs no
+    handshake, a host's limit jumps to the full 'max_per_host' once it answers over HTTP/2 instead of ramping up to
+    it, and only comes down if the host pushes back. Hosts that don't offer HTTP/2 fall back to HTTP/1.1, and
+    'close' logs how many responses came over each protocol. Retries, the 'HostController' and the cache otherwise
+    work exactly as in 'AsyncDownloader'.
+
+    Args:
+        max_downloads (int): The maximum number of concurrent downloads overall. Defaults to MAX_DOWNLOADS.
+        max_per_host (int): The most concurrent downloads a single host's limit may grow to. Defaults to
+            MAX_PER_HOST.
+        cache (ImageCache): A cache to revalidate images against before downloading them. It is closed along
+            with the downloader.
+        prior_knowledge (bool): Speak HTTP/2 without negotiating it first, which is the only way to use it over
+            plain http:// URLs. Only for servers known to support it, such as the benchmark fixtures.
+
+    Example:
+        with Http2Downloader() as downloader:
+            download_images("https://example.com/gallery", downloader)
+    """
 
+    def __init__(
+        self,
+        max_downloads=MAX_DOWNLOADS,
+        max_per_host=MAX_PER_HOST,
+        cache=None,
+        prior_knowledge=False,
+    ):
+        self._prior_knowledge = prior_knowledge
+        super().__init__(max_downloads, max_per_host, cache)
+
+    def _make_client(self, max_downloads):
+        return httpx.AsyncClient(
+            http1=not self._prior_knowledge,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=max_downloads,
+                max_keepalive_connections=max_downloads,
+            ),
+            follow_redirects=True,
+        )
+
+
+ENGINES = {"threads": Downloader, "async": AsyncDownloader, "http2": Http2Downloader}
+
+
+class ImageSourceScanner(HTMLParser):
+    """
+    Collects the 'src' attribute of <img> start tags without building a document tree.
+
+    It tokenizes the document with the same parser BeautifulSoup's 'html.parser' backend uses, so it finds the
+    same sources, but ignores every other tag and never allocates elements.
+
+    Example:
+        scanner = ImageSourceScanner()
+        scanner.feed('<p><img src="/uploads/page-01.jpg"></p>')
+        print(scanner.sources)
+        # Output: ['/uploads/page-01.jpg']
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sources = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "img":
+            return
+        # Like BeautifulSoup, let a repeated attribute override earlier ones
+        src = dict(attrs).get("src", False)
+        if src is not False:
+            self.sources.append(src or "")
+
+
+def extract_image_sources(html, parser="html.parser"):
+    """
+    Extracts the source URLs of all <img> tags in an HTML document.
+
+    Args:
+        html (bytes): The HTML document.
+        parser (str): The backend to parse with, one of PARSERS:
+            'html.parser' builds a BeautifulSoup tree, as the script always has;
+            'lxml' parses with libxml2, which is much faster on large pages;
+            'scan' only looks at <img> start tags with an 'ImageSourceScanner'.
+
+    Returns:
+        list: The 'src' attribute of every <img> tag that has one, in document order.
+
+    Every backend decodes the document with BeautifulSoup's 'UnicodeDammit', so they agree on pages that don't
+    declare their encoding. They differ on an <img> tag with more than one 'src' attribute: 'html.parser' and
+    'scan' take the last one, as BeautifulSoup does, while libxml2 keeps the first, as browsers do.
+
+    Example:
+        print(extract_image_sources(b'<p><img src="/uploads/page-01.jpg"></p>', parser="scan"))
+        # Output: ['/uploads/page-01.jpg']
+    """
+
+    if parser == "lxml":
+        # libxml2 would take bytes without a declared encoding for Latin-1, so hand it the decoded text as UTF-8
+        markup = UnicodeDammit(html, is_html=True).unicode_markup.encode("utf-8")
+        try:
+            # A parser of its own, as lxml parsers can't be shared between threads
+            document = lxml.html.fromstring(
+                markup, parser=lxml.html.HTMLParser(encoding="utf-8")
+            )
+        except lxml.etree.ParserError:
+            # libxml2 refuses an empty or whitespace-only body, which has no images either
+            return []
+        return [str(src) for src in document.xpath("//img/@src")]
+
+    if parser == "scan":
+        scanner = ImageSourceScanner()
+        scanner.feed(UnicodeDammit(html, is_html=True).unicode_markup)
+        scanner.close()
+        return scanner.sources
+
+    # Create a BeautifulSoup object to parse the HTML content
+    soup = BeautifulSoup(html, "html.parser")
+
+    # Find all <img> tags in the parsed HTML
+    return [img["src"] for img in soup.find_all("img", src=True)]
+
+
+PARSERS = ["html.parser", "lxml", "scan"]
+
+
+def selector_tags(selectors):
+    """
+    Returns the tag names CSS 'selectors' can match, or None if any of them can match any tag, or depends on the
+    elements around its match, such as '.pagination a' or 'a:last-child'.
+
+    Example:
+        print(selector_tags(("a[rel~=next]", "link[rel~=next]")))
+        # Output: {'a', 'link'}
+    """
+
+    tags = set()
+    for selector in selectors:
+        compound = re.sub(r"\[[^\]]*\]", "", selector.strip())
+        tag = re.match(r"[A-Za-z][\w-]*", compound)
+        if tag is None or re.search(r"[\s>+~,:]", compound):
+            return None
+        tags.add(tag.group().lower())
+    return tags
+
+
+def find_next_page(html, page_url, options=ChapterOptions()):
+    """
+    Finds the link to the next page of a paginated gallery.
+
+    Args:
+        html (bytes): The HTML document of the current page.
+        page_url (str): The URL of the current page, which relative links are resolved against.
+        options (ChapterOptions): The chapter settings. 'next_selectors' are CSS selectors tried in order; the
+            'href' of the first element matching one is the next page.
+
+    Returns:
+        str: The absolute URL of the next page, or None if no selector matches.
+
+    The page is parsed with libxml2 for the 'lxml' parser, and with Python's HTML tokenizer otherwise. When the
+    selectors only look at the matching tags themselves, as the default ones do, no other elements are built.
+
+    Example:
+        print(find_next_page(b'<a rel="next" href="?page=2">Next</a>', "https://example.com/gallery"))
+        # Output: 'https://example.com/gallery?page=2'
+    """
+
+    tags = selector_tags(options.next_selectors)
+    soup = BeautifulSoup(
+        html,
+        "lxml" if options.parser == "lxml" else "html.parser",
+        parse_only=SoupStrainer(sorted(tags)) if tags else None,
+    )
+    for selector in options.next_selectors:
+        link = soup.select_one(selector)
+        if link is not None and link.get("href"):
+            return urljoin(page_url, link["href"])
+    return None
+
+
+def fetch_gallery_page(
+    url, session, cache=None, options=ChapterOptions(), metrics=None
+):
+    """
+    Fetches one page of a gallery and extracts the image sources and the next page from it.
+
+    Args:
+        url (str): The URL of the page.
+        session (requests.Session): The session to fetch the page with.
+        cache (ImageCache): A cache holding the page from earlier runs, if any.
+        options (ChapterOptions): The chapter settings. 'parser' picks the 'extract_image_sources' backend, and
+            the next page is only looked for if 'max_pages' is above 1.
+        metrics (Metrics): Collects the time spent in the 'gallery_fetch' and 'parse' stages, if given.
+
+    Returns:
+        tuple: The image sources on the page, and the URL of the next page or None.
 
-def download_images(url):
+    With a cache, the request revalidates the copy of the page from an earlier run. If the server answers
+    304 Not Modified, the image sources and next-page link extracted from that copy are reused and the page is
+    neither transferred nor parsed again.
+    """
+
+    metrics = metrics or Metrics()
+    cached_page = cache.page(url) if cache else None
+
+    # Send a GET request to the webpage
+    with metrics.stage("gallery_fetch"):
+        response = session.get(
+            url, headers=cached_page.conditional_headers if cached_page else {}
+        )
+        response.raise_for_status()
+        html = cached_page.body if response.status_code == 304 else response.content
+
+    with metrics.stage("parse"):
+        if response.status_code == 304:
+            logging.info("Page unchanged since last run: %s", url)
+            image_sources = cached_page.image_sources
+        else:
+            image_sources = extract_image_sources(html, options.parser)
+            if cache:
+                cache.store_page(url, html, response.headers, image_sources)
+
+        next_url = None
+        if options.max_pages > 1:
+            selectors = list(options.next_selectors)
+            if response.status_code == 304:
+                next_url = cache.next_page(url, selectors)
+            if next_url is None:
+                next_url = find_next_page(html, url, options)
+                if cache:
+                    cache.store_next_page(url, selectors, next_url)
+    return image_sources, next_url or None
+
+
+def find_image_urls(url, session, cache=None, options=ChapterOptions(), metrics=None):
+    """
+    Finds the URLs of the page images in a gallery, following its pagination.
+
+    Args:
+        url (str): The URL of the first page of the gallery.
+        session (requests.Session): The session to fetch the gallery pages with.
+        cache (ImageCache): A cache holding the gallery pages from earlier runs, if any.
+        options (ChapterOptions): The chapter settings, passed on to 'fetch_gallery_page'. Up to 'max_pages'
+            pages are followed through the links matching 'next_selectors'. 'page_template' overrides the page
+            set 'find_page_set' detects.
+        metrics (Metrics): Collects the time spent in the 'gallery_fetch', 'parse' and 'filter' stages, if
+            given.
+
+    Yields:
+        str: The image URLs in the order they appear in the gallery, without duplicates.
+
+    Each page is fetched with 'fetch_gallery_page', which finds all <img> tags in it. The source URLs of the
+    images are filtered based on the `path_filters` list, and only the ones in the dominant page set of the
+    first page, as found by 'find_page_set', are kept. Later pages are matched against the same template.
+
+    The function is a generator, and the next page is fetched on a background thread as soon as the current one
+    has been parsed. A caller downloading the images of a page as they are yielded keeps its download pool busy
+    while the rest of the gallery is discovered.
+
+    Example:
+        session = backoff_retry_session()
+        print(list(find_image_urls("https://example.com/gallery", session)))
+        # Output: ['https://example.com/uploads/page-01.jpg', 'https://example.com/uploads/page-02.jpg', ...]
+    """
+
+    path_filters = ["/uploads", "/images"]
+    metrics = metrics or Metrics()
+
+    template = options.page_template
+    seen_urls = set()
+    visited_pages = {url}
+    with ThreadPoolExecutor(max_workers=1) as discovery:
+        page = discovery.submit(
+            fetch_gallery_page, url, session, cache, options, metrics
+        )
+        for page_number in range(1, options.max_pages + 1):
+            image_sources, next_url = page.result()
+
+            # Fetch the next page while the images of this one are downloaded
+            page = None
+            if (
+                next_url
+                and next_url not in visited_pages
+                and page_number < options.max_pages
+            ):
+                visited_pages.add(next_url)
+                page = discovery.submit(
+                    fetch_gallery_page, next_url, session, cache, options, metrics
+                )
+
+            with metrics.stage("filter"):
+                image_urls = [
+                    src
+                    for src in image_sources
+                    if any(value in src for value in path_filters)
+                ]
+                logging.debug("Found the following image URLs: %s", image_urls)
+
+                page_set = find_page_set(image_urls, template)
+                if page_number == 1:
+                    logging.info(
+                        "Page set %s: %s of %s images on the first page",
+                        page_set.template,
+                        len(page_set.urls),
+                        page_set.total,
+                    )
+                template = page_set.template
+                new_urls = []
+                for img_url in page_set.urls:
+                    if img_url not in seen_urls:
+                        seen_urls.add(img_url)
+                        new_urls.append(img_url)
+            yield from new_urls
+
+            if page is None:
+                break
+        logging.info("Found %s images on %s pages", len(seen_urls), page_number)
+
+
+def download_images(
+    url, downloader=None, save_directory=None, options=ChapterOptions()
+):
     """
     Downloads images from a webpage based on the provided URL.
 
     Args:
         url (str): The URL of the webpage to download images from.
+        downloader (Downloader): The shared download state to use. If not provided, one is created for this call
+            and closed before returning.
+        save_directory (str): The directory to save the images in, which makes the download resumable. If not
+            provided, a new temporary directory is created.
+        options (ChapterOptions): The chapter settings, passed on to 'find_image_urls'.
 
     Returns:
         str: The path of the directory where the downloaded images are saved.
@@ -117,73 +2018,560 @@ def download_images(url):
     Raises:
         Any exceptions raised during the download process will be propagated.
 
-    The function sends a GET request to the specified URL, parses the HTML content using BeautifulSoup,
-    and finds all <img> tags in the parsed HTML. It extracts the source URLs of the images and filters
-    them based on the provided `path_filters` list. The function then creates a temporary directory to
-    save the downloaded images.
+    The function looks up the page images with 'find_image_urls' and downloads them into the save directory,
+    starting on the images of each gallery page while the next page is being fetched.
+
+    Multiple images are downloaded concurrently on the downloader's worker pools. All workers share one session
+    whose connection pool is sized to the per-host worker count, so each connection is set up once and kept alive
+    for the rest of the run. The function submits download tasks and waits for all of them to complete.
 
-    Multiple images are downloaded concurrently using a ThreadPoolExecutor. The function submits download
-    tasks to the executor and waits for all tasks to complete. If any exception occurs during the download,
-    the temporary directory is removed. Finally, the function returns the path of the directory where the
-    downloaded images are saved.
+    Every finished image is added to the directory's 'Manifest'. Images the manifest lists whose file is still
+    intact are only revalidated with the server, using the ETag and Last-Modified they were served with, so if any
+    download fails, running the function again with the same save directory only fetches the missing, damaged or
+    changed pages. Images served without either validator are trusted as they are. Finally, the function returns
+    the path of the directory where the downloaded images are saved.
 
     Example:
-        download_images("https://example.com/gallery")
+        download_images("https://example.com/gallery", save_directory="comic.cbz.pages")
     """
 
-    path_filters = ["/uploads", "/images"]
+    owns_downloader = downloader is None
+    downloader = downloader or Downloader()
+    try:
+        # Create a directory to save the downloaded images
+        if save_directory is None:
+            save_directory = tempfile.mkdtemp()
+        os.makedirs(save_directory, exist_ok=True)
+        for part_file in Path(save_directory).glob(f".*{PART_SUFFIX}"):
+            part_file.unlink()
+
+        manifest = Manifest(save_directory)
+
+        # Submit download tasks to the downloader as the gallery pages are parsed
+        download_tasks = {}
+        image_count = 0
+        revalidated = 0
+        for img_url in find_image_urls(
+            url, downloader.page_session, downloader.cache, options, downloader.metrics
+        ):
+            image_count += 1
+            known = None
+            if manifest.is_complete(img_url):
+                if not manifest.validators(img_url):
+                    continue
+                known = manifest.entries[img_url]
+                revalidated += 1
+            downloader.progress.found()
+            task = downloader.download(img_url, save_directory, known)
+            download_tasks[task] = img_url
+        if revalidated or len(download_tasks) < image_count:
+            logging.info(
+                "Resuming: %s of %s images already downloaded, %s to revalidate",
+                image_count - len(download_tasks) + revalidated,
+                image_count,
+                revalidated,
+            )
+
+        # Record each image as it completes, so a failure keeps everything before it
+        failures = 0
+        for task in as_completed(download_tasks):
+            try:
+                manifest.add(download_tasks[task], task.result())
+            except Exception:  # pylint: disable=broad-exception-caught
+                logging.exception("Failed to download %s", download_tasks[task])
+                failures += 1
+        if failures:
+            raise RuntimeError(
+                f"{failures} of {image_count} images failed to download; "
+                f"run again to resume from {save_directory}"
+            )
+    finally:
+        if owns_downloader:
+            downloader.close()
+    return save_directory
 
-    session = backoff_retry_session()
 
-    # Send a GET request to the webpage
-    response = session.get(url)
+def chain(future, submit):
+    """
+    Returns a future for the task 'submit' schedules with the result of 'future', once 'future' is done.
 
-    # Create a BeautifulSoup object to parse the HTML content
-    soup = BeautifulSoup(response.content, "html.parser")
+    Unlike calling 'submit' from a callback of the first task's own pool, no worker of that pool waits for the
+    second task. Cancelling the returned future before the second task starts also cancels 'future'.
 
-    # Find all <img> tags in the parsed HTML
-    img_tags = soup.find_all("img")
-    image_urls = [
-        img["src"]
-        for img in img_tags
-        if any(value in img["src"] for value in path_filters)
-    ]
-    logging.debug("Found the following image URLs: %s", image_urls)
+    Args:
+        future (concurrent.futures.Future): The first task.
+        submit (callable): Schedules the second task for the result of the first and returns its future.
+
+    Returns:
+        concurrent.futures.Future: The future of the second task, or the exception of the first.
+
+    Example:
+        future = chain(downloader.fetch(img_url), partial(process_pool.submit, transcode_image, name))
+    """
 
-    image_prefix = find_prefix(image_urls)
-    image_urls = [url for url in image_urls if image_prefix in url]
+    chained = Future()
 
-    # Create a directory to save the downloaded images
-    save_directory = tempfile.mkdtemp()
+    def start(first):
+        if not chained.set_running_or_notify_cancel():
+            return
+        try:
+            second = submit(first.result())
+        except BaseException as error:
+            chained.set_exception(error)
+            return
+        second.add_done_callback(finish)
 
-    # Download images with source URLs containing '/uploads'
+    def finish(second):
+        if second.cancelled():
+            chained.set_exception(CancelledError())
+        elif second.exception() is not None:
+            chained.set_exception(second.exception())
+        else:
+            chained.set_result(second.result())
+
+    chained.add_done_callback(lambda done: done.cancelled() and future.cancel())
+    future.add_done_callback(start)
+    return chained
+
+
+def ordered_map(submit, iterable, window):
+    """
+    Schedules a task for each item of 'iterable' and yields the results in input order, keeping at most 'window'
+    tasks submitted ahead of the consumer.
+
+    Args:
+        submit (callable): Schedules the task for one item and returns its concurrent.futures.Future.
+        iterable (iterable): The items to process.
+        window (int): The maximum number of submitted tasks whose results have not been consumed yet.
+
+    Returns:
+        generator: The results of the tasks, in the same order as 'iterable'.
+
+    Unlike 'Executor.map', items are only submitted as earlier results are consumed, so a slow consumer bounds
+    the number of results held in memory.
+
+    Example:
+        with ThreadPoolExecutor() as executor:
+            for data in ordered_map(partial(executor.submit, Path.read_bytes), paths, window=10):
+                print(len(data))
+    """
+
+    items = iter(iterable)
+    pending = deque(submit(item) for item in islice(items, window))
     try:
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            # Submit download tasks to the executor
-            download_tasks = [
-                executor.submit(download_image, img_url, save_directory)
-                for img_url in image_urls
-            ]
-            # Wait for all tasks to complete
-            for task in download_tasks:
-                task.result()
-    except:
-        shutil.rmtree(save_directory)
-    return save_directory
+        while pending:
+            task = pending.popleft()
+            # Keep the window full while the consumer handles this result
+            for item in islice(items, 1):
+                pending.append(submit(item))
+            yield task.result()
+    finally:
+        # Don't start work nobody will consume if the consumer stopped early
+        for task in pending:
+            task.cancel()
+
+
+ZipEntry = namedtuple(
+    "ZipEntry", ["name", "method", "crc", "size", "payload", "date_time"]
+)
+
+
+def prepare_entry(name, data, compression, date_time=None):
+    """
+    Prepares an archive entry for 'ZipWriter': computes its CRC32 and, for deflate, compresses it.
+
+    Args:
+        name (str): The name of the entry inside the archive.
+        data (bytes): The uncompressed content of the entry.
+        compression (str): Either 'store' or 'deflate'.
+        date_time (tuple): The (year, month, day, hour, minute, second) modification time of the entry.
+            Defaults to the current local time.
+
+    Returns:
+        ZipEntry: The entry, ready to be written.
+
+    Both zlib.crc32 and zlib compression release the GIL on large buffers, so this is meant to run on a thread
+    pool while the previous entry is being written out.
+
+    Example:
+        entry = prepare_entry("page-01.jpg", Path("page-01.jpg").read_bytes(), "store")
+    """
 
+    crc = zlib.crc32(data)
+    if compression == "deflate":
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        payload = compressor.compress(data) + compressor.flush()
+        method = zipfile.ZIP_DEFLATED
+    else:
+        payload = data
+        method = zipfile.ZIP_STORED
+    return ZipEntry(
+        name, method, crc, len(data), payload, date_time or time.localtime()[:6]
+    )
+
+
+TranscodedPage = namedtuple(
+    "TranscodedPage",
+    ["name", "original_size", "size", "seconds", "error"],
+    defaults=[None],
+)
+
+
+def transcode_image(name, data, transcode):
+    """
+    Downscales an image to fit 'transcode.max_dimension' and re-encodes it.
+
+    Args:
+        name (str): The file name of the image.
+        data (bytes): The image.
+        transcode (Transcode): The maximum width and height, if any, and the output format and quality.
+
+    Returns:
+        tuple: The file name with the extension of the new format, and the encoded image. An image that needs no
+        downscaling and doesn't get smaller by re-encoding is returned unchanged, under its own name.
+
+    Pages are scaled with Lanczos filtering, keeping their aspect ratio, after being rotated upright according to
+    their EXIF orientation. JPEG sources are decoded at a reduced scale directly when they are much larger than
+    the target size, which is much faster than decoding them fully.
+
+    Example:
+        name, data = transcode_image("page-01.png", png_data, Transcode(1600, "webp", 80))
+        print(name)
+        # Output: "page-01.webp"
+    """
+
+    pillow_format, extension = TRANSCODE_FORMATS[transcode.format]
+    with Image.open(io.BytesIO(data)) as image:
+        limit = transcode.max_dimension
+        if limit:
+            image.draft(image.mode, (limit, limit))
+        page = ImageOps.exif_transpose(image)
+    oversized = limit and max(page.size) > limit
+    if oversized:
+        page.thumbnail((limit, limit), Image.Resampling.LANCZOS)
+    modes = ("L", "RGB") if pillow_format == "JPEG" else ("RGB", "RGBA")
+    if page.mode not in modes:
+        keep_alpha = pillow_format == "WEBP" and page.has_transparency_data
+        page = page.convert("RGBA" if keep_alpha else "RGB")
+
+    output = io.BytesIO()
+    page.save(output, pillow_format, quality=transcode.quality)
+    if not oversized and output.tell() >= len(data):
+        return name, data
+    return os.path.splitext(name)[0] + extension, output.getvalue()
+
+
+def transcode_entry(name, data, compression, transcode, date_time=None):
+    """
+    Transcodes an image with 'transcode_image' and prepares it as an archive entry with 'prepare_entry'.
+
+    Meant to run on a ProcessPoolExecutor, as image encoding holds the GIL.
+
+    Returns:
+        tuple: The ZipEntry and a 'TranscodedPage' with the sizes and the time it took to transcode. A page Pillow
+        can't decode, such as AVIF without its plugin, goes into the archive as it is, with the reason in 'error',
+        rather than failing the whole chapter.
+    """
+
+    started = time.perf_counter()
+    error = None
+    try:
+        new_name, new_data = transcode_image(name, data, transcode)
+    except Image.UnidentifiedImageError:
+        new_name, new_data, error = name, data, "Pillow can't read this format"
+    except (OSError, Image.DecompressionBombError) as e:
+        new_name, new_data, error = name, data, str(e)
+    seconds = time.perf_counter() - started
+    entry = prepare_entry(new_name, new_data, compression, date_time)
+    return entry, TranscodedPage(name, len(data), len(new_data), seconds, error)
+
+
+def read_transcoded_entry(file, name, compression, transcode):
+    """Reads an image file and returns 'transcode_entry' for it as 'name', keeping its modification time."""
+
+    date_time = time.localtime(file.stat().st_mtime)[:6]
+    return transcode_entry(name, file.read_bytes(), compression, transcode, date_time)
+
+
+class TranscodeReport:
+    """
+    Logs each transcoded page of an archive and, at the end, how many bytes transcoding saved and how long the
+    pages took to encode.
+    """
 
-def create_cbz(output_name, directory):
+    def __init__(self):
+        self.pages = []
+
+    def add(self, page):
+        """Records and logs a 'TranscodedPage'."""
+
+        self.pages.append(page)
+        if page.error:
+            logging.warning(
+                "Kept %s as it is, as it could not be transcoded: %s",
+                page.name,
+                page.error,
+            )
+            return
+        logging.info(
+            "Transcoded: %s (%.0f KB -> %.0f KB in %.0f ms)",
+            page.name,
+            page.original_size / 1000,
+            page.size / 1000,
+            page.seconds * 1000,
+        )
+
+    def log_summary(self, output_name):
+        """Logs the totals for the archive 'output_name'."""
+
+        if not self.pages:
+            return
+        original = sum(page.original_size for page in self.pages)
+        saved = original - sum(page.size for page in self.pages)
+        seconds = [page.seconds for page in self.pages]
+        logging.info(
+            "Transcoded %s pages of %s: saved %.1f MB of %.1f MB (%.0f%%), "
+            "encode time per page: median %.0f ms, max %.0f ms",
+            len(self.pages),
+            output_name,
+            saved / 1_000_000,
+            original / 1_000_000,
+            100 * saved / original if original else 0,
+            statistics.median(seconds) * 1000,
+            max(seconds) * 1000,
+        )
+
+
+class ZipWriter:
     """
-    Creates a Comic Book Zip (CBZ) file by compressing the image files from the specified directory into a zip archive.
+    Writes a ZIP archive from entries prepared by 'prepare_entry'.
+
+    zipfile.ZipFile computes each CRC32 while writing an entry and then seeks back to patch the local header.
+    As entries here arrive with their CRC32 and compressed payload already known, every header is final when
+    written, the file is only ever appended to, and the checksum and compression work can happen on other
+    threads ahead of the writer.
+
+    Archives needing ZIP64 (4 GiB or 65535 entries) are not supported and raise zipfile.LargeZipFile.
+
+    Example:
+        with ZipWriter("comic.cbz") as archive:
+            archive.write_entry(prepare_entry("page-01.jpg", data, "store"))
+    """
+
+    def __init__(self, path):
+        self.bytes_packed = 0
+        self._file = open(path, "wb")
+        self._central_directory = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def write_entry(self, entry):
+        """Appends an entry's local header and payload to the archive."""
+
+        offset = self._file.tell()
+        if (
+            offset + len(entry.payload) > ZIP_MAX_SIZE
+            or entry.size > ZIP_MAX_SIZE
+            or len(self._central_directory) >= ZIP_MAX_ENTRIES
+        ):
+            raise zipfile.LargeZipFile("Archive would require ZIP64 extensions")
+
+        name = entry.name.encode("utf-8")
+        year, month, day, hour, minute, second = entry.date_time
+        dos_date = (year - 1980) << 9 | month << 5 | day
+        dos_time = hour << 11 | minute << 5 | second // 2
+        fields = (
+            20,  # version needed to extract
+            ZIP_FLAG_UTF8,
+            entry.method,
+            dos_time,
+            dos_date,
+            entry.crc,
+            len(entry.payload),
+            entry.size,
+            len(name),
+        )
+        self._file.write(struct.pack("<4s5H3L2H", b"PK\x03\x04", *fields, 0))
+        self._file.write(name)
+        self._file.write(entry.payload)
+        self._central_directory.append((fields, name, offset))
+        self.bytes_packed += entry.size
+
+    def close(self):
+        """Writes the central directory and closes the archive."""
+
+        offset = self._file.tell()
+        for fields, name, header_offset in self._central_directory:
+            self._file.write(
+                struct.pack(
+                    "<4s6H3L5H2L",
+                    b"PK\x01\x02",
+                    ZIP_MADE_BY_UNIX,
+                    *fields,
+                    0,  # extra field length
+                    0,  # comment length
+                    0,  # disk number
+                    0,  # internal attributes
+                    0o100644 << 16,  # external attributes: regular file, rw-r--r--
+                    header_offset,
+                )
+            )
+            self._file.write(name)
+        size = self._file.tell() - offset
+        if offset + size > ZIP_MAX_SIZE:
+            raise zipfile.LargeZipFile("Archive would require ZIP64 extensions")
+        entries = len(self._central_directory)
+        self._file.write(
+            struct.pack(
+                "<4s4H2LH", b"PK\x05\x06", 0, 0, entries, entries, size, offset, 0
+            )
+        )
+        self._file.close()
+
+
+def log_archive_throughput(output_name, archive, started):
+    """
+    Logs how much image data went into a finished archive and how fast it was built.
+
+    Args:
+        output_name (str): The name of the archive.
+        archive (ZipWriter): The writer the archive was built with.
+        started (float): The time.perf_counter() value from when the build started.
+    """
+
+    elapsed = time.perf_counter() - started
+    megabytes = archive.bytes_packed / 1_000_000
+    logging.info(
+        "Created %s: %.1f MB in %.2fs (%.1f MB/s)",
+        output_name,
+        megabytes,
+        elapsed,
+        megabytes / elapsed if elapsed else 0,
+    )
+
+
+def stream_cbz(url, output_name, options=ChapterOptions(), downloader=None):
+    """
+    Downloads images from a webpage and writes them straight into a Comic Book Zip (CBZ) file.
+
+    Args:
+        url (str): The URL of the webpage to download images from.
+        output_name (str): The name of the CBZ file to be created.
+        options (ChapterOptions): The chapter settings. 'compression' is either 'store' (the default, as page
+            images are already compressed) or 'deflate'. With 'transcode', each image is transcoded on the
+            downloader's 'transcoder' pool once it has been downloaded. With 'allow_gaps', missing page numbers are
+            only logged.
+        downloader (Downloader): The shared download state to use. If not provided, one is created for this call
+            and closed before returning.
+
+    Raises:
+        RuntimeError: If page numbers are missing from the sequence and 'allow_gaps' isn't set.
+        Any exceptions raised during the download process will be propagated.
+
+    Unlike 'download_images' followed by 'create_cbz', no staging directory is used: every image crosses the
+    disk once, on its way into the archive. Downloads, and the CRC32 of each image, run on the downloader's pools
+    while the calling thread is the only writer to the archive. It takes finished downloads in page order, so at
+    most PIPELINE_WINDOW images are held in memory at any time. The archive is built under a '.part' name and
+    only renamed to 'output_name' once every page has been written and 'check_page_sequence' found no gaps; on
+    failure the partial archive is removed. Pages are named by 'page_name' in gallery order, as the whole page
+    set isn't known until the last one has been written.
+
+    Example:
+        stream_cbz("https://example.com/gallery", "comic.cbz")
+    """
+
+    source_names = []
+
+    def fetch_entry(page):
+        number, img_url = page
+        source_names.append(img_url.split("/")[-1])
+        name = page_name(number, source_names[-1])
+        downloader.progress.found()
+        if options.transcode:
+            return chain(
+                downloader.fetch(img_url),
+                lambda data: transcoder.submit(
+                    transcode_entry, name, data, options.compression, options.transcode
+                ),
+            )
+        return downloader.fetch(
+            img_url, lambda data: prepare_entry(name, data, options.compression)
+        )
+
+    owns_downloader = downloader is None
+    downloader = downloader or Downloader()
+    transcoder = downloader.transcoder() if options.transcode else None
+    report = TranscodeReport()
+    part_name = output_name + PART_SUFFIX
+    try:
+        image_urls = find_image_urls(
+            url, downloader.page_session, downloader.cache, options, downloader.metrics
+        )
+        window = TRANSCODE_WINDOW if transcoder else PIPELINE_WINDOW
+        started = time.perf_counter()
+        with ZipWriter(part_name) as archive:
+            logging.info("Creating %s...", output_name)
+            for entry in ordered_map(fetch_entry, enumerate(image_urls, 1), window):
+                if transcoder:
+                    entry, page = entry
+                    report.add(page)
+                logging.debug("Adding file %s...", entry.name)
+                archive.write_entry(entry)
+            check_page_sequence(source_names, output_name, options.allow_gaps)
+        os.replace(part_name, output_name)
+        log_archive_throughput(output_name, archive, started)
+        report.log_summary(output_name)
+    except BaseException:
+        if os.path.exists(part_name):
+            os.unlink(part_name)
+        raise
+    finally:
+        if owns_downloader:
+            downloader.close()
+
+
+def create_cbz(
+    output_name,
+    directory,
+    compression="store",
+    transcode=None,
+    allow_gaps=False,
+    transcoder=None,
+):
+    """
+    Creates a Comic Book Zip (CBZ) file by packing the image files from the specified directory into a zip archive.
 
     Args:
         output_name (str): The name of the CBZ file to be created.
         directory (str or Path): The directory path containing the image files to be included in the CBZ file.
+        compression (str): Either 'store' (the default, as page images are already compressed) or 'deflate'.
+        transcode (Transcode): If given, the images are downscaled and re-encoded with 'transcode_image' on their
+            way into the archive. The files in 'directory' are left as they are.
+        allow_gaps (bool): Only log missing page numbers instead of failing.
+        transcoder (ProcessPoolExecutor): The process pool to transcode on, such as 'Downloader.transcoder', which
+            is left running. If not given, a pool is started for this call and shut down before returning.
 
     Raises:
         TypeError: If the 'output_name' or 'directory' arguments are not strings or Path objects.
         FileNotFoundError: If the specified directory does not exist.
         OSError: If there are any issues with creating or writing to the CBZ file.
+        RuntimeError: If page numbers are missing from the sequence and 'allow_gaps' isn't set.
+
+    Files are read and checksummed on a ThreadPoolExecutor, up to PIPELINE_WINDOW files ahead of the entry
+    being written, and the build throughput is logged once the archive is complete. When transcoding, they are
+    read, transcoded and checksummed on a ProcessPoolExecutor instead, so every core encodes pages, and the bytes
+    saved are logged as well.
+
+    Pages are written in natural order, so 'page-9' comes before 'page-10', under zero-padded names from
+    'page_name' that keep that order for readers sorting them as plain strings. The page numbers are checked
+    with 'check_page_sequence' before anything is written.
 
     Example:
         output_name = 'comic.cbz'
@@ -192,22 +2580,165 @@ def create_cbz(output_name, directory):
         # Creates a CBZ file named 'comic.cbz' containing the image files from the '/path/to/images/' directory.
 
     Note:
-        The function relies on the 'get_image_list' function to retrieve the list of image files from the specified directory.
-        Make sure the 'get_image_list' function is defined and available before calling 'create_cbz'.
+        The function relies on the 'get_image_list' function to retrieve the list of image files from the specified
+        directory. Make sure the 'get_image_list' function is defined and available before calling 'create_cbz'.
     """
 
+    def read_entry(file, name):
+        date_time = time.localtime(file.stat().st_mtime)[:6]
+        return prepare_entry(name, file.read_bytes(), compression, date_time)
+
     file_list = get_image_list(directory)
+    check_page_sequence([file.name for file in file_list], output_name, allow_gaps)
+    pages = [
+        (file, page_name(number, file.name)) for number, file in enumerate(file_list, 1)
+    ]
+    if transcode:
+        owns_executor = transcoder is None
+        executor = transcoder or ProcessPoolExecutor()
+        task = partial(
+            read_transcoded_entry, compression=compression, transcode=transcode
+        )
+        window = TRANSCODE_WINDOW
+    else:
+        owns_executor = True
+        executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        task = read_entry
+        window = PIPELINE_WINDOW
+    report = TranscodeReport()
+
+    part_name = output_name + PART_SUFFIX
+    started = time.perf_counter()
+    try:
+        with ZipWriter(part_name) as archive:
+            logging.info("Creating %s...", output_name)
+            for entry in ordered_map(
+                lambda page: executor.submit(task, *page), pages, window
+            ):
+                if transcode:
+                    entry, page = entry
+                    report.add(page)
+                logging.debug("Adding file %s...", entry.name)
+                archive.write_entry(entry)
+        os.replace(part_name, output_name)
+    except BaseException:
+        if os.path.exists(part_name):
+            os.unlink(part_name)
+        raise
+    finally:
+        if owns_executor:
+            executor.shutdown()
+    log_archive_throughput(output_name, archive, started)
+    report.log_summary(output_name)
+
+
+def natural_key(name):
+    """
+    Returns a sort key for 'name' that orders the numbers in it by value, so 'page-9.jpg' sorts before
+    'page-10.jpg'. Letters are compared case-insensitively.
+    """
+
+    return [
+        int(part) if part.isdigit() else part.lower()
+        for part in NATURAL_PARTS.split(name)
+    ]
+
+
+def page_name(number, source_name):
+    """
+    Returns the archive name of the page at 1-based position 'number': the position zero-padded to
+    PAGE_NAME_WIDTH digits, with the extension of 'source_name'.
+
+    Example:
+        print(page_name(7, "chapter-12-page-7.JPG"))
+        # Output: "0007.jpg"
+    """
+
+    return f"{number:0{PAGE_NAME_WIDTH}d}{os.path.splitext(source_name)[1].lower()}"
+
+
+def missing_pages(names):
+    """
+    Finds the page numbers missing between the first and the last page.
+
+    Args:
+        names (list): The file names of the pages. They can only be checked when they all share one
+            'page_template' with a single number in it, which is then the page number. Names made of hashes or
+            timestamps, or with more than one number, such as an image size after the page number, say nothing
+            reliable about missing pages. Neither do numbers spread out more thinly than one page in two, such as
+            the time of day in 'IMG_20240101_120000.jpg'.
+
+    Returns:
+        list: The missing page numbers in ascending order. Empty if there are none, or if the names can't be
+        checked.
+
+    Example:
+        print(missing_pages(["page-01.jpg", "page-02.jpg", "page-05.jpg"]))
+        # Output: [3, 4]
+    """
+
+    stems = [os.path.splitext(name)[0] for name in names]
+    templates = {page_template(stem) for stem in stems}
+    if len(templates) != 1 or templates.pop().count("{n}") != 1:
+        return []
+
+    numbers = {
+        int(NUMBER_PATTERN.search(HASH_PATTERN.sub("{hash}", stem)).group())
+        for stem in stems
+    }
+    missing = [
+        number
+        for number in range(min(numbers), max(numbers) + 1)
+        if number not in numbers
+    ]
+    if len(missing) > len(numbers):
+        return []
+    return missing
+
+
+def format_ranges(numbers):
+    """Formats ascending numbers compactly, such as [3, 4, 5, 9] as '3-5, 9'."""
+
+    ranges = []
+    for number in numbers:
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(
+        str(first) if first == last else f"{first}-{last}" for first, last in ranges
+    )
+
+
+def check_page_sequence(names, output_name, allow_gaps=False):
+    """
+    Reports page numbers missing from the pages of an archive before it is finalized.
+
+    Args:
+        names (list): The file names of the pages, as for 'missing_pages'.
+        output_name (str): The name of the archive, for the message.
+        allow_gaps (bool): Log a warning instead of raising.
+
+    Raises:
+        RuntimeError: If pages are missing and 'allow_gaps' is False.
+    """
 
-    with zipfile.ZipFile(output_name, mode="w") as archive:
-        logging.info("Creating %s...", output_name)
-        for file in file_list:
-            logging.debug("Adding file %s...", file.name)
-            archive.write(str(file), file.name)
+    missing = missing_pages(names)
+    if not missing:
+        return
+    pages = "pages" if len(missing) > 1 else "page"
+    message = f"{output_name} is missing {pages} {format_ranges(missing)}"
+    if allow_gaps:
+        logging.warning(message)
+        return
+    raise RuntimeError(f"{message}; use --allow-gaps to build it anyway")
 
 
 def get_image_list(directory):
     """
-    Retrieves a list of image files present in the specified directory and its subdirectories.
+    Retrieves a list of image files present in the specified directory and its subdirectories, in natural order
+    of their names. Hidden files, such as unfinished downloads ('.part' files) and the download manifest, are
+    never included.
 
     Args:
         directory (str or Path): The directory path where the image files are located.
@@ -228,81 +2759,460 @@ def get_image_list(directory):
 
     files = list(directory.expanduser().iterdir())
 
-    image_list = [file for file in files]
+    image_list = sorted(
+        (file for file in files if not file.name.startswith(".")),
+        key=lambda file: natural_key(file.name),
+    )
     logging.info("Found %s images", len(image_list))
 
     return image_list
 
 
-def find_prefix(urls):
+def page_template(img_url):
+    """
+    Returns the path template of an image URL: its directory, and its filename with every number, and every
+    hash-like run of hex digits, replaced by a placeholder.
+
+    The host is left out, so pages spread over the shards of a CDN still share a template.
+
+    Args:
+        img_url (str): The URL of the image.
+
+    Returns:
+        str: The template.
+
+    Example:
+        print(page_template("https://example.com/uploads/2024/01/chapter-12-page-07.jpg"))
+        # Output: "/uploads/2024/01/chapter-{n}-page-{n}.jpg"
     """
-    Given a list of URLs, extracts the prefix of the filename from each URL,
-    appends it to a list, and returns the most common prefix.
+
+    directory, _, filename = urlsplit(img_url).path.rpartition("/")
+    filename = NUMBER_PATTERN.sub("{n}", HASH_PATTERN.sub("{hash}", filename))
+    return f"{directory}/{filename}"
+
+
+def find_page_set(urls, template=None):
+    """
+    Groups image URLs by their 'page_template' and picks the page images among them.
 
     Args:
-        urls (list): A list of URLs.
+        urls (list): The image URLs found on a gallery page, in page order.
+        template (str): The template of the page set to pick. Defaults to the template shared by the most URLs,
+            the first one to appear winning a tie.
 
     Returns:
-        str: The most common prefix of the filenames extracted from the URLs.
+        PageSet: The 'template' of the page set, or None if there are no URLs, its 'urls' in page order, and the
+        'total' number of URLs considered.
+
+    The URLs are grouped in a single pass with a dict, so the cost grows linearly with the size of the gallery.
+    Unlike matching a common filename prefix, pages are told apart from thumbnails and theme images by their
+    whole name pattern, whatever their names start with.
 
     Example:
         urls = [
-            "https://example.com/files/file1.txt",
-            "https://example.com/files/file2.txt",
-            "https://example.com/files/file3.txt",
-            "https://example.com/files/file4.txt"
+            "https://example.com/uploads/chapter-12-page-01.jpg",
+            "https://example.com/uploads/chapter-12-page-02.jpg",
+            "https://example.com/uploads/logo.png",
         ]
-        print(find_prefix(urls))
-        # Output: "file1.txt"
+        print(find_page_set(urls))
+        # Output: PageSet(template='/uploads/chapter-{n}-page-{n}.jpg', urls=[...page-01.jpg, ...page-02.jpg],
+        #         total=3)
     """
 
-    prefixes = []
-
+    clusters = defaultdict(list)
     for url in urls:
-        file = url.split("/")[-1]
-        prefixes.append(file[0:12])
+        clusters[page_template(url)].append(url)
+
+    if template is None and clusters:
+        template = max(clusters, key=lambda candidate: len(clusters[candidate]))
+    return PageSet(template, clusters.get(template, []), len(urls))
+
+
+def cbz_name(output_name):
+    """Returns 'output_name' with a '.cbz' extension, adding one if it is missing."""
 
-    most_common = Counter(prefixes).most_common()[0][0]
-    logging.debug("Found prefix %s", most_common)
+    if not output_name.endswith(".cbz"):
+        output_name = output_name + ".cbz"
+    return output_name
 
-    return most_common
+
+def build_cbz(url, output_name, downloader, options=ChapterOptions()):
+    """
+    Downloads the images from a webpage and packs them into a Comic Book Zip (CBZ) file.
+
+    Args:
+        url (str): The URL of the webpage from which images should be downloaded.
+        output_name (str): The name of the CBZ file to be created.
+        downloader (Downloader): The shared download state to use.
+        options (ChapterOptions): The chapter settings. With 'pipeline', downloads are streamed directly into the
+            archive with 'stream_cbz' instead of being staged in a directory first.
+
+    Without 'pipeline', images are staged in '<output_name>.pages', which is only removed once the CBZ file has
+    been created. After a failure, calling the function again resumes from the images already in it.
+
+    Example:
+        with Downloader() as downloader:
+            build_cbz("https://example.com/gallery", "comic.cbz", downloader)
+    """
+
+    if options.pipeline:
+        with downloader.metrics.stage("stream_cbz"):
+            stream_cbz(url, output_name, options, downloader)
+        return
+
+    with downloader.metrics.stage("download_images"):
+        directory = Path(
+            download_images(url, downloader, output_name + PAGES_SUFFIX, options)
+        )
+    with downloader.metrics.stage("create_cbz"):
+        create_cbz(
+            output_name,
+            directory,
+            options.compression,
+            options.transcode,
+            options.allow_gaps,
+            downloader.transcoder() if options.transcode else None,
+        )
+    shutil.rmtree(directory)
+
+
+@contextmanager
+def instrumented(downloader, metrics_json=None, profile=None):
+    """
+    Yields 'downloader' and closes it afterwards, like using it in a 'with' block, showing its progress with
+    'show_progress' meanwhile, and then writes what was measured during the block, even if it failed.
+
+    Args:
+        downloader (Downloader): The downloader to use.
+        metrics_json (str): The file to write the downloader's 'Metrics' to as JSON, if any.
+        profile (str): The file to write a cProfile of the block to, if any, for 'python -m pstats' or
+            snakeviz. Since Python 3.12 cProfile records every thread while it is enabled, so besides the calling
+            thread, which writes the archives, the profile covers the 'find_image_urls' discovery worker that
+            fetches and parses the gallery pages, and the download workers. Time spent waiting on the network
+            shows up as time in socket calls; the metrics break it down per request.
+
+    Example:
+        with instrumented(Downloader(), "metrics.json", "run.prof") as downloader:
+            build_cbz("https://example.com/gallery", "comic.cbz", downloader)
+    """
+
+    profiler = cProfile.Profile() if profile else None
+    try:
+        with downloader, show_progress(downloader.progress):
+            if profiler:
+                profiler.enable()
+            try:
+                yield downloader
+            finally:
+                if profiler:
+                    profiler.disable()
+    finally:
+        if metrics_json:
+            downloader.metrics.write(metrics_json)
+        if profiler:
+            profiler.dump_stats(profile)
+            logging.info("Wrote profile to %s", profile)
+
+
+def read_batch(path):
+    """
+    Reads the chapters of a batch file.
+
+    Args:
+        path (str): A file with one 'url<TAB>output-name' pair per line. Blank lines and lines starting with '#'
+            are ignored.
+
+    Returns:
+        list: (url, output_name) tuples, with '.cbz' added to output names where missing.
+
+    Raises:
+        click.BadParameter: If a line does not hold exactly two tab-separated fields.
+    """
+
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) != 2:
+                raise click.BadParameter(
+                    f"line {line_number}: expected 'url<TAB>output-name'",
+                    param_hint="--batch",
+                )
+            url, output_name = (field.strip() for field in fields)
+            jobs.append((url, cbz_name(output_name)))
+    return jobs
+
+
+def run_batch(jobs, downloader, max_chapters, options=ChapterOptions()):
+    """
+    Builds many CBZ files concurrently, sharing one downloader between all of them.
+
+    Args:
+        jobs (list): (url, output_name) tuples as returned by 'read_batch'.
+        downloader (Downloader): The shared download state, which caps concurrent downloads overall and per host.
+        max_chapters (int): The maximum number of chapters being worked on at once.
+        options (ChapterOptions): The chapter settings, passed on to 'build_cbz'.
+
+    Returns:
+        int: The number of chapters that failed. Chapters whose output file already exists are skipped and not
+        counted as failures, so a failed batch can simply be run again.
+    """
+
+    def build(url, output_name):
+        if os.path.exists(output_name):
+            logging.info("Output file %s already exists. Skipping", output_name)
+            return
+        build_cbz(url, output_name, downloader, options)
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max_chapters) as executor:
+        tasks = {
+            executor.submit(build, url, output_name): output_name
+            for url, output_name in jobs
+        }
+        for task, output_name in tasks.items():
+            try:
+                task.result()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logging.exception("Failed to create %s", output_name)
+                failures += 1
+    logging.info("Finished %s of %s chapters", len(jobs) - failures, len(jobs))
+    return failures
 
 
 @click.command()
-@click.argument("url")
-@click.argument("output-name")
-def main(url, output_name):
+@click.argument("url", required=False)
+@click.argument("output-name", required=False)
+@click.option(
+    "--pipeline",
+    is_flag=True,
+    help="Write images straight into the CBZ as they download, without staging them in a directory",
+)
+@click.option(
+    "--compression",
+    type=click.Choice(["store", "deflate"]),
+    default="store",
+    show_default=True,
+    help="How to pack the images; they are usually compressed already, so storing them is fastest",
+)
+@click.option(
+    "--max-dimension",
+    type=click.IntRange(min=1),
+    help="Downscale pages to fit this many pixels in width and height, re-encoding them",
+)
+@click.option(
+    "--format",
+    "image_format",
+    type=click.Choice(list(TRANSCODE_FORMATS)),
+    help="Re-encode pages to this format, on all cores, to make the CBZ smaller  [default with --max-dimension: jpeg]",
+)
+@click.option(
+    "--quality",
+    default=Transcode().quality,
+    show_default=True,
+    type=click.IntRange(1, 100),
+    help="Encoder quality when re-encoding pages",
+)
+@click.option(
+    "--allow-gaps",
+    is_flag=True,
+    help="Build the CBZ even if page numbers are missing from the sequence",
+)
+@click.option(
+    "--parser",
+    type=click.Choice(PARSERS),
+    default="html.parser",
+    show_default=True,
+    help="How to find the images in the page; 'lxml' and 'scan' are much faster on large galleries",
+)
+@click.option(
+    "--max-pages",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Follow the gallery's next-page links for up to this many pages",
+)
+@click.option(
+    "--page-template",
+    "template",
+    help="Only download the images whose path matches this template, such as "
+    "'/uploads/2024/01/chapter-{n}-page-{n}.jpg', instead of the page set found on the first page",
+)
+@click.option(
+    "--next-selector",
+    "next_selectors",
+    multiple=True,
+    default=NEXT_SELECTORS,
+    show_default=True,
+    help="CSS selector of the next-page link, tried in order (can be repeated)",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(list(ENGINES)),
+    default="threads",
+    show_default=True,
+    help="Download images on a thread pool, as asyncio coroutines, which scales to many more concurrent downloads, "
+    "or as coroutines multiplexed over one HTTP/2 connection per host",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    help="Cache downloaded images in this directory and revalidate them on later runs",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=1),
+    default=CACHE_MAX_SIZE // 1024**2,
+    show_default=True,
+    help="Maximum size of the image cache in MiB",
+)
+@click.option(
+    "--batch",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Build every 'url<TAB>output-name' line of this file instead of a single URL",
+)
+@click.option(
+    "--max-chapters",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of chapters built concurrently in batch mode",
+)
+@click.option(
+    "--max-downloads",
+    type=click.IntRange(min=1),
+    default=MAX_DOWNLOADS,
+    show_default=True,
+    help="Maximum number of concurrent image downloads",
+)
+@click.option(
+    "--max-per-host",
+    type=click.IntRange(min=1),
+    default=MAX_PER_HOST,
+    show_default=True,
+    help="Upper bound for the adaptive number of concurrent image downloads from one host",
+)
+@click.option(
+    "--metrics-json",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write per-stage wall times and per-image request timings, retries and bytes to this JSON file",
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write a cProfile of the run to this file",
+)
+def main(
+    url,
+    output_name,
+    pipeline,
+    compression,
+    max_dimension,
+    image_format,
+    quality,
+    allow_gaps,
+    parser,
+    max_pages,
+    template,
+    next_selectors,
+    engine,
+    cache_dir,
+    cache_size,
+    batch,
+    max_chapters,
+    max_downloads,
+    max_per_host,
+    metrics_json,
+    profile,
+):
     """
     Main function for the application that downloads images from a webpage and creates a Comic Book Zip (CBZ) file.
 
     Args:
         url (str): The URL of the webpage from which images should be downloaded.
-        output_name (str): The desired name of the CBZ file to be created. If it does not end with '.cbz', the extension will be added automatically.
+        output_name (str): The desired name of the CBZ file to be created. If it does not end with '.cbz', the
+            extension will be added automatically.
+        pipeline (bool): Stream downloads directly into the archive with 'stream_cbz' instead of staging them in
+            a directory first.
+        compression (str): Either 'store' or 'deflate', passed on to 'create_cbz' or 'stream_cbz'.
+        max_dimension (int): The size to downscale pages to fit, if any.
+        image_format (str): The format to re-encode pages to, a key of TRANSCODE_FORMATS. Defaults to 'jpeg' if
+            'max_dimension' is given; without either, pages are packed as downloaded.
+        quality (int): The encoder quality when re-encoding pages.
+        allow_gaps (bool): Build the CBZ even if page numbers are missing.
+        parser (str): The 'extract_image_sources' backend, one of PARSERS.
+        max_pages (int): The number of gallery pages to follow.
+        template (str): The 'page_template' of the page images, overriding the detected page set.
+        next_selectors (tuple): CSS selectors of the next-page link.
+        engine (str): The key in ENGINES of the downloader to use, 'threads', 'async' or 'http2'.
+        cache_dir (str): The directory of the 'ImageCache' to use, if any.
+        cache_size (int): The maximum size of the image cache in MiB.
+        batch (str): A file of 'url<TAB>output-name' lines to build instead of 'url' and 'output_name'.
+        max_chapters (int): The number of chapters built concurrently in batch mode.
+        max_downloads (int): The maximum number of concurrent image downloads across all chapters.
+        max_per_host (int): The upper bound for the adaptive number of concurrent image downloads from one host.
+        metrics_json (str): The file to write the run's 'Metrics' to, if any.
+        profile (str): The file to write a cProfile of the run to, if any.
 
     Raises:
-        SystemExit: If the specified output file already exists, the program will exit with a non-zero status code.
+        SystemExit: If the specified output file already exists, or any chapter of a batch failed, the program
+            will exit with a non-zero status code.
 
     Example:
         $ python my_script.py https://example.com/gallery my_comic
         # Downloads images from the URL 'https://example.com/gallery' and creates a CBZ file named 'my_comic.cbz'.
 
+        $ python my_script.py --batch chapters.tsv
+        # Creates every CBZ file listed in 'chapters.tsv', reusing one connection pool for all of them.
+
     Note:
-        The function relies on the 'download_images', 'create_cbz', 'shutil', 'os', 'sys', 'Path' classes, and the 'click' library.
+        The function relies on the 'Downloader', 'build_cbz', 'run_batch', 'os', 'sys' classes, and the 'click' library.
         Make sure these dependencies are defined and available before calling the 'main' function.
     """
 
-    if not output_name.endswith(".cbz"):
-        output_name = output_name + ".cbz"
+    transcode = None
+    if max_dimension or image_format:
+        transcode = Transcode(max_dimension, image_format or "jpeg", quality)
+    options = ChapterOptions(
+        pipeline,
+        compression,
+        parser,
+        max_pages,
+        tuple(next_selectors),
+        transcode,
+        template,
+        allow_gaps,
+    )
+
+    def make_downloader():
+        cache = ImageCache(cache_dir, cache_size * 1024**2) if cache_dir else None
+        downloader = ENGINES[engine](max_downloads, max_per_host, cache)
+        return instrumented(downloader, metrics_json, profile)
+
+    if batch:
+        if url or output_name:
+            raise click.UsageError("URL and OUTPUT_NAME cannot be used with --batch")
+        jobs = read_batch(batch)
+        with make_downloader() as downloader:
+            failures = run_batch(jobs, downloader, max_chapters, options)
+        if failures:
+            sys.exit(1)
+        return
+
+    if not url or not output_name:
+        raise click.UsageError("URL and OUTPUT_NAME are required without --batch")
+
+    output_name = cbz_name(output_name)
 
     if os.path.exists(output_name):
         logging.error("Output file %s already exists. Aborting", output_name)
         sys.exit(1)
 
-    directory = Path(download_images(url))
-    try:
-        create_cbz(output_name, directory)
-    finally:
-        shutil.rmtree(directory)
+    with make_downloader() as downloader:
+        build_cbz(url, output_name, downloader, options)
 
 
 if __name__ == "__main__":
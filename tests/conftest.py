@@ -0,0 +1,29 @@
+import importlib.machinery
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def load_script(file_name, module_name):
+    """Import one of the repo's standalone scripts as a module, with or without a .py suffix."""
+    path = str(REPO / file_name)
+    loader = importlib.machinery.SourceFileLoader(module_name, path)
+    spec = importlib.util.spec_from_file_location(module_name, path, loader=loader)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def cbz():
+    return load_script("cbz-from-webpage.py", "cbz_from_webpage")
+
+
+@pytest.fixture
+def photo_import(tmp_path, monkeypatch):
+    """photo-import with its picture library and index under a temporary home directory."""
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    return load_script("photo-import", "photo_import")
@@ -0,0 +1,34 @@
+import pytest
+
+
+@pytest.mark.parametrize("parser", ["html.parser", "lxml", "scan"])
+def test_parsers_agree(cbz, parser):
+    html = b'<p><img src="/a.jpg"><img alt="x"><img src="b.png"></p>'
+    assert cbz.extract_image_sources(html, parser=parser) == ["/a.jpg", "b.png"]
+
+
+@pytest.mark.parametrize("parser", ["html.parser", "lxml", "scan"])
+@pytest.mark.parametrize("html", [b"", b"  \n\t"])
+def test_empty_body_has_no_images(cbz, parser, html):
+    assert cbz.extract_image_sources(html, parser=parser) == []
+
+
+@pytest.mark.parametrize("parser", ["html.parser", "lxml", "scan"])
+def test_undeclared_utf8_is_decoded_alike(cbz, parser):
+    html = '<p><img src="/uploads/ページ01.jpg"></p>'.encode()
+    assert cbz.extract_image_sources(html, parser=parser) == ["/uploads/ページ01.jpg"]
+
+
+@pytest.mark.parametrize("parser", ["html.parser", "lxml", "scan"])
+def test_declared_encoding_is_honoured(cbz, parser):
+    html = '<meta charset="shift_jis"><img src="/ページ01.jpg">'.encode("shift_jis")
+    assert cbz.extract_image_sources(html, parser=parser) == ["/ページ01.jpg"]
+
+
+@pytest.mark.parametrize(
+    "parser, expected",
+    [("html.parser", "/b.jpg"), ("lxml", "/a.jpg"), ("scan", "/b.jpg")],
+)
+def test_repeated_src_attribute(cbz, parser, expected):
+    html = b'<img src="/a.jpg" src="/b.jpg">'
+    assert cbz.extract_image_sources(html, parser=parser) == [expected]
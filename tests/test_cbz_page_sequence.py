@@ -0,0 +1,40 @@
+import pytest
+
+
+def test_numbered_pages_report_gaps(cbz):
+    names = ["page-01.jpg", "page-02.jpg", "page-05.jpg"]
+    assert cbz.missing_pages(names) == [3, 4]
+
+
+def test_hash_named_pages_are_not_checked(cbz):
+    names = ["5f3a9b2c.jpg", "8e1d7a40.jpg", "c0ffee12.jpg"]
+    assert cbz.missing_pages(names) == []
+    cbz.check_page_sequence(
+        ["a3f9c2e1.png", "b7d04e88.png", "c1e5f0a2.png"], "hashy.cbz"
+    )
+
+
+def test_timestamp_named_pages_are_not_checked(cbz):
+    names = ["20240101-120000.jpg", "20240101-120500.jpg", "20240101-131500.jpg"]
+    assert cbz.missing_pages(names) == []
+    names = ["1704110400123.jpg", "1704110400456.jpg", "1704110499999.jpg"]
+    assert cbz.missing_pages(names) == []
+
+
+def test_dimension_suffixed_pages_are_not_checked(cbz):
+    names = ["page-01-1200x800.jpg", "page-02-1200x800.jpg", "page-05-1200x800.jpg"]
+    assert cbz.missing_pages(names) == []
+
+
+def test_hash_alongside_page_number(cbz):
+    names = ["ch12-5f3a9b2c-p1.jpg", "ch12-8e1d7a40-p2.jpg", "ch12-c0ffee12-p4.jpg"]
+    assert cbz.missing_pages(names) == []
+    names = ["5f3a9b2c-p1.jpg", "8e1d7a40-p2.jpg", "c0ffee12-p4.jpg"]
+    assert cbz.missing_pages(names) == [3]
+
+
+def test_gap_fails_unless_allowed(cbz):
+    names = ["page-1.jpg", "page-2.jpg", "page-4.jpg"]
+    with pytest.raises(RuntimeError, match="missing page 3"):
+        cbz.check_page_sequence(names, "gappy.cbz")
+    cbz.check_page_sequence(names, "gappy.cbz", allow_gaps=True)
@@ -0,0 +1,26 @@
+import io
+
+from PIL import Image
+
+
+def png(size):
+    output = io.BytesIO()
+    Image.new("RGB", size, "white").save(output, "PNG")
+    return output.getvalue()
+
+
+def test_page_is_downscaled_and_reencoded(cbz):
+    entry, page = cbz.transcode_entry(
+        "0001.png", png((400, 200)), "store", cbz.Transcode(100)
+    )
+    assert entry.name == "0001.jpg"
+    with Image.open(io.BytesIO(entry.payload)) as image:
+        assert image.size == (100, 50)
+    assert page.error is None
+
+
+def test_undecodable_page_is_kept_as_it_is(cbz):
+    data = b"\x00\x00\x00\x1cftypavif not really"
+    entry, page = cbz.transcode_entry("0001.avif", data, "store", cbz.Transcode(100))
+    assert (entry.name, entry.payload) == ("0001.avif", data)
+    assert page.error == "Pillow can't read this format"
@@ -0,0 +1,149 @@
+import os
+from datetime import datetime
+
+from click.testing import CliRunner
+
+CAPTURED = datetime(2024, 5, 17, 14, 30)
+
+
+def make_card(root, files):
+    """A card with a DCIM folder holding files, a {name: data} dict, all shot at CAPTURED."""
+    folder = root / "DCIM" / "100CANON"
+    folder.mkdir(parents=True)
+    for name, data in files.items():
+        path = folder / name
+        path.write_bytes(data)
+        os.utime(path, (CAPTURED.timestamp(), CAPTURED.timestamp()))
+    return root
+
+
+def run_import(photo_import, card, *options):
+    result = CliRunner().invoke(photo_import.main, [str(card), *options])
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def library_day(photo_import):
+    return photo_import.PICTURES_DIR / "2024" / "05" / "17"
+
+
+def test_same_name_from_cards_imported_in_separate_runs(photo_import, tmp_path):
+    first = make_card(tmp_path / "card1", {"IMG_0001.CR2": b"first camera"})
+    second = make_card(tmp_path / "card2", {"IMG_0001.CR2": b"the second camera"})
+
+    run_import(photo_import, first)
+    run_import(photo_import, second)
+    day = library_day(photo_import)
+    assert (day / "IMG_0001.CR2").read_bytes() == b"first camera"
+    assert (day / "IMG_0001-2.CR2").read_bytes() == b"the second camera"
+
+    # Running either card again finds its copy instead of making another
+    run_import(photo_import, first)
+    run_import(photo_import, second)
+    assert sorted(path.name for path in day.iterdir()) == [
+        "IMG_0001-2.CR2",
+        "IMG_0001.CR2",
+    ]
+
+
+def test_existing_copy_under_numbered_name_is_not_copied_again(photo_import, tmp_path):
+    first = make_card(tmp_path / "card1", {"IMG_0001.CR2": b"first camera"})
+    second = make_card(tmp_path / "card2", {"IMG_0001.CR2": b"the second camera"})
+    run_import(photo_import, first)
+    run_import(photo_import, second)
+
+    # Without the index, the files on disk are all there is to go by
+    photo_import.INDEX_PATH.unlink()
+    result = run_import(photo_import, second, "--verbose")
+    assert "IMG_0001-2.CR2 already exists" in result.output
+    day = library_day(photo_import)
+    assert (day / "IMG_0001.CR2").read_bytes() == b"first camera"
+    assert sorted(path.name for path in day.iterdir()) == [
+        "IMG_0001-2.CR2",
+        "IMG_0001.CR2",
+    ]
+
+
+def test_reindex_keeps_source_names_of_renamed_copies(photo_import, tmp_path):
+    first = make_card(tmp_path / "card1", {"IMG_0001.CR2": b"first camera"})
+    second = make_card(tmp_path / "card2", {"IMG_0001.CR2": b"the second camera"})
+    run_import(photo_import, first)
+    run_import(photo_import, second)
+
+    result = run_import(photo_import, second, "--reindex", "--verbose")
+    assert "already imported" in result.output
+    result = run_import(photo_import, first, "--reindex", "--verbose")
+    assert "already imported" in result.output
+
+
+def test_no_checksum_without_kernel_copies_uses_shutil(
+    photo_import, tmp_path, monkeypatch
+):
+    copy2 = photo_import.shutil.copy2
+    copied = []
+
+    def recording_copy2(src, dst):
+        copied.append(src)
+        return copy2(src, dst)
+
+    monkeypatch.setattr(photo_import, "KERNEL_COPIES", [])
+    monkeypatch.setattr(photo_import.shutil, "copy2", recording_copy2)
+    card = make_card(tmp_path / "card", {"IMG_0001.CR2": b"raw data"})
+
+    run_import(photo_import, card, "--no-checksum")
+    copy = library_day(photo_import) / "IMG_0001.CR2"
+    assert copy.read_bytes() == b"raw data"
+    assert copy.stat().st_mtime == CAPTURED.timestamp()
+    assert len(copied) == 1
+
+
+def test_dedupe_finds_earlier_copies_without_rescanning_the_library(
+    photo_import, tmp_path, monkeypatch
+):
+    card = make_card(tmp_path / "card", {"IMG_0001.CR2": b"raw data"})
+    run_import(photo_import, card, "--dedupe")
+
+    def no_scan():
+        raise AssertionError("the library was scanned again")
+
+    monkeypatch.setattr(photo_import, "scan_library", no_scan)
+    backup = make_card(tmp_path / "backup", {"IMG_0001.CR2": b"raw data"})
+    os.utime(
+        backup / "DCIM" / "100CANON" / "IMG_0001.CR2", (0, CAPTURED.timestamp() + 60)
+    )
+    result = run_import(photo_import, backup, "--dedupe", "--verbose")
+    assert "has the same content as" in result.output
+    assert [path.name for path in library_day(photo_import).iterdir()] == [
+        "IMG_0001.CR2"
+    ]
+
+
+def test_dedupe_hashes_each_source_file_once(photo_import, tmp_path, monkeypatch):
+    hashed = []
+
+    def counting(column, hash_file):
+        def counted(path):
+            hashed.append((os.path.basename(path), column))
+            return hash_file(path)
+
+        return counted
+
+    monkeypatch.setattr(
+        photo_import.LibraryHashes,
+        "HASHES",
+        {
+            column: counting(column, hash_file)
+            for column, hash_file in photo_import.LibraryHashes.HASHES.items()
+        },
+    )
+    files = {"IMG_0001.CR2": b"aaaa", "IMG_0002.CR2": b"aaaa", "IMG_0003.CR2": b"bbbb"}
+    files["IMG_0004.CR2"] = b"cccc"
+    card = make_card(tmp_path / "card", files)
+
+    run_import(photo_import, card, "--dedupe")
+    assert len(hashed) == len(set(hashed))
+    assert sorted(path.name for path in library_day(photo_import).iterdir()) == [
+        "IMG_0001.CR2",
+        "IMG_0003.CR2",
+        "IMG_0004.CR2",
+    ]